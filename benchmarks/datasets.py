@@ -0,0 +1,156 @@
+"""Synthetic datasets matching the handlers' schemas, written to local SQLite files so every path can run without credentials."""
+from datetime import datetime
+from sqlalchemy import create_engine, Column, DateTime, Float, ForeignKey, Integer, MetaData, String, Table, Text, Boolean, JSON
+import numpy as np
+import os
+import pandas as pd
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+# Rows generated and inserted at once, keeps generation memory flat up to 1e7 rows
+BATCH_SIZE = 100000
+# Rows are spread over this many days of 'modified_to_db_time', the YouTube handlers read one day at a time
+DAYS = 7
+START_DATE = datetime(2021, 1, 1)
+# Columns that hold free text get sentences of varying length instead of short labels
+TEXT_COLUMNS = ('transcript', 'description', 'comment_displayed', 'comment_original', 'content', 'text', 'title', 'video_title')
+WORDS = np.array("the of and to in is video news channel people vaccine data world today covid report live update new full".split())
+
+# Stand-in for the blogtrackers tables DatabaseToDatabaseManager reflects
+reflected = MetaData()
+Table('blogsites', reflected,
+    Column('blogsite_id', Integer, primary_key=True),
+    Column('blogsite_name', String(255)),
+    Column('blogsite_url', String(255)),
+    Column('totalposts', Integer),
+    Column('last_crawled', DateTime),
+)
+Table('blogposts', reflected,
+    Column('blogpost_id', Integer, primary_key=True),
+    Column('title', String(255)),
+    Column('date', DateTime),
+    Column('content', Text),
+    Column('num_comments', Integer),
+    Column('sentiment', Float),
+    Column('blogsite_id', Integer, ForeignKey('blogsites.blogsite_id')),
+)
+
+def sentences(rng, count=512):
+    lengths = rng.integers(3, 60, count)
+    return np.array([" ".join(rng.choice(WORDS, n)) for n in lengths], dtype=object)
+
+def columnValues(column, index, rows, rng, pool):
+    """Values of one column for the rows in 'index'. Composite keys combine an entity (i // DAYS) with a day (i % DAYS)."""
+    pks = [c.name for c in column.table.primary_key.columns]
+    position = pks.index(column.name) if column.name in pks else None
+    if position is not None and len(pks) > 1:
+        index = index // DAYS if position == 0 else index % DAYS
+    if isinstance(column.type, DateTime):
+        if position is not None:
+            return pd.to_datetime(START_DATE) + pd.to_timedelta(index, unit='D')
+        return pd.to_datetime(START_DATE) + pd.to_timedelta(index % DAYS, unit='D') + pd.to_timedelta((index // DAYS) % 86400, unit='s')
+    if isinstance(column.type, Boolean):
+        return rng.random(len(index)) < 0.5
+    if isinstance(column.type, Integer):
+        if position is not None:
+            return index + 1
+        # Foreign keys point at the parent table, which holds a hundredth of the rows
+        if column.foreign_keys:
+            return rng.integers(1, max(rows // 100, 1) + 1, len(index))
+        return rng.integers(0, 1000000, len(index))
+    if isinstance(column.type, Float):
+        return rng.random(len(index))
+    if isinstance(column.type, JSON):
+        return [None] * len(index)
+    if position is not None:
+        return [f"{column.name}_{i}" for i in index]
+    if column.name in TEXT_COLUMNS:
+        return pool[rng.integers(0, len(pool), len(index))]
+    return [f"{column.name}_{i}" for i in rng.integers(0, 1000, len(index))]
+
+def frames(table, rows, seed=0):
+    pool = sentences(np.random.default_rng(seed))
+    for start in range(0, rows, BATCH_SIZE):
+        rng = np.random.default_rng(seed + start)
+        index = np.arange(start, min(start + BATCH_SIZE, rows))
+        yield pd.DataFrame({column.name: columnValues(column, index, rows, rng, pool) for column in table.columns})
+
+def fill(engine, table, rows):
+    for df in frames(table, rows):
+        with engine.begin() as connection:
+            connection.execute(table.insert(), df.to_dict(orient='records'))
+
+def sqliteEngine(path):
+    # Prefetching readers and parallel writers use the engine from other threads
+    return create_engine(f"sqlite:///{path}", connect_args={'check_same_thread': False})
+
+def database(name, metadata, rows, sizes=None):
+    """Path of a SQLite file holding 'rows' synthetic rows in every table of 'metadata', generated on first use."""
+    path = os.path.join(DATA_DIR, f"{name}_{rows}.db")
+    if os.path.exists(path):
+        return path
+    os.makedirs(DATA_DIR, exist_ok=True)
+    # Generated aside so an interrupted generation is never reused
+    engine = sqliteEngine(f"{path}.tmp")
+    metadata.create_all(engine)
+    for table in metadata.sorted_tables:
+        fill(engine, table, (sizes or {}).get(table.name, rows))
+    engine.dispose()
+    os.replace(f"{path}.tmp", path)
+    return path
+
+def csvFile(name, table, rows):
+    path = os.path.join(DATA_DIR, f"{name}_{rows}.csv")
+    if os.path.exists(path):
+        return path
+    os.makedirs(DATA_DIR, exist_ok=True)
+    for i, df in enumerate(frames(table, rows)):
+        df.to_csv(f"{path}.tmp", mode='a' if i else 'w', header=i == 0, index=False)
+    os.replace(f"{path}.tmp", path)
+    return path
+
+def parquetFile(name, table, rows):
+    """The rows of csvFile as a parquet file, one row group per generated batch. Needs pyarrow."""
+    import pyarrow
+    import pyarrow.parquet
+    path = os.path.join(DATA_DIR, f"{name}_{rows}.parquet")
+    if os.path.exists(path):
+        return path
+    os.makedirs(DATA_DIR, exist_ok=True)
+    writer = None
+    for df in frames(table, rows):
+        batch = pyarrow.Table.from_pandas(df, preserve_index=False)
+        writer = writer or pyarrow.parquet.ParquetWriter(f"{path}.tmp", batch.schema)
+        writer.write_table(batch)
+    writer.close()
+    os.replace(f"{path}.tmp", path)
+    return path
+
+def csvDirectory(name, table, rows, files=16):
+    """The rows of csvFile spread over several files, like chunked comment dumps."""
+    path = os.path.join(DATA_DIR, f"{name}_{rows}")
+    if os.path.exists(path):
+        return path
+    os.makedirs(f"{path}.tmp")
+    # First row of each file, batches are appended to the files they overlap so only one is in memory
+    bounds = np.cumsum([0] + [len(part) for part in np.array_split(np.arange(rows), files)])
+    start = 0
+    for df in frames(table, rows):
+        for i in range(files):
+            low, high = max(bounds[i], start), min(bounds[i + 1], start + df.shape[0])
+            if low < high:
+                df.iloc[low - start:high - start].to_csv(os.path.join(f"{path}.tmp", f"{name}_{i:03d}.csv"), mode='a' if low > bounds[i] else 'w', header=low == bounds[i], index=False)
+        start += df.shape[0]
+    os.replace(f"{path}.tmp", path)
+    return path
+
+def tweetIds(rows, files=4):
+    """Directory of csv seed files (tweet id, sentiment) like the ones PostsHandler reads."""
+    path = os.path.join(DATA_DIR, f"tweets_{rows}")
+    if os.path.exists(path):
+        return path
+    os.makedirs(f"{path}.tmp")
+    rng = np.random.default_rng(0)
+    for i, ids in enumerate(np.array_split(np.arange(rows) + 10 ** 18, files)):
+        pd.DataFrame({'id': ids, 'sentiment': rng.random(len(ids))}).to_csv(os.path.join(f"{path}.tmp", f"ids_{i}.csv"), index=False)
+    os.replace(f"{path}.tmp", path)
+    return path
@@ -0,0 +1,63 @@
+"""Tweet flattening: the previous row-wise path against flattenTweets, on synthetic hydrated tweets.
+
+    python -m benchmarks.flatten --tweets 100000
+"""
+import argparse
+import time
+
+import pandas as pd
+
+from projectManagers.handlers.twitterHandler import TWITTER_DATE_FORMAT, flattenTweets
+from .hydrator import SyntheticHydrator
+
+def rowWise(tweets, dataset_id):
+    """PostsHandler.process/format_data and UsersHandler.format_data before flattenTweets."""
+    df = pd.DataFrame(tweets)
+    df['source_id'] = dataset_id
+    df.drop_duplicates(subset='id', inplace=True)
+    users_df = pd.DataFrame(df['user'].tolist())
+    df = df.drop(columns=["id"])
+    df = df.rename(columns={"id_str": "id", "full_text": "text"})
+    df['created_at'] = pd.to_datetime(df.created_at, format=TWITTER_DATE_FORMAT)
+    df['quoted_status_id_str'] = None
+    df['possibly_sensitive'] = None
+    df['retweet_id_str'] = df.apply(lambda row : row['retweeted_status']['id_str'] if 'retweeted_status' in row and isinstance(row['retweeted_status'], dict) else None, axis=1)
+    df['user'] = df.apply(lambda row : row['user']['id_str'], axis=1)
+    users_df.drop_duplicates("id", inplace=True)
+    users_df = users_df.drop(columns=["id"])
+    users_df = users_df.rename(columns={"id_str": "id"})
+    users_df['created_at'] = pd.to_datetime(users_df.created_at, format=TWITTER_DATE_FORMAT)
+    return df, users_df
+
+def measure(function, tweets, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(tweets, 0)
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return best, result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tweets', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    tweets = list(SyntheticHydrator().hydrate(range(10 ** 18, 10 ** 18 + args.tweets)))
+    old_seconds, (old_posts, old_users) = measure(rowWise, tweets, args.repeat)
+    new_seconds, (new_posts, new_users) = measure(flattenTweets, tweets, args.repeat)
+
+    # Both paths have to produce the same stored values
+    columns = [c for c in new_posts.columns if c in old_posts.columns]
+    pd.testing.assert_frame_equal(old_posts[columns].reset_index(drop=True), new_posts[columns].reset_index(drop=True), check_dtype=False)
+    columns = [c for c in new_users.columns if c in old_users.columns]
+    pd.testing.assert_frame_equal(old_users[columns].reset_index(drop=True), new_users[columns].reset_index(drop=True), check_dtype=False)
+
+    print(f"{len(tweets):,} tweets, {new_users.shape[0]:,} users")
+    print(f"row-wise:      {old_seconds:.3f}s ({len(tweets) / old_seconds:,.0f} tweets/s)")
+    print(f"flattenTweets: {new_seconds:.3f}s ({len(tweets) / new_seconds:,.0f} tweets/s)")
+    print(f"speedup:       {old_seconds / new_seconds:.1f}x")
+
+if __name__ == '__main__':
+    main()
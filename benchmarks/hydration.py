@@ -0,0 +1,43 @@
+"""Concurrent hydration against the local stand-in server, serial lookups against several workers and credentials.
+
+    python -m benchmarks.hydration --tweets 20000 --tokens 3 --workers 8 --limit 50 --window 5
+"""
+import argparse
+import time
+
+from projectManagers.handlers.concurrentHydrator import ConcurrentHydrator
+from .hydrator import RETURNED
+from .twitterServer import LookupServer
+
+def run(ids, tokens, workers, args):
+    server = LookupServer(tokens=tokens, limit=args.limit, window=args.window, latency=args.latency, error_rate=args.error_rate, gzip_error_rate=args.gzip_error_rate).start()
+    hydrator = ConcurrentHydrator(tokens, workers=workers, url=server.url, timeout=10)
+    start = time.time()
+    tweets = list(hydrator.hydrate(ids))
+    seconds = time.time() - start
+    server.shutdown()
+    returned = {tweet['id_str'] for tweet in tweets}
+    expected = {str(id) for id in ids if id % 100 < RETURNED * 100}
+    assert returned == expected, f"{len(expected - returned)} tweets missing"
+    print(f"{workers} worker(s), {len(tokens)} credential(s): {len(tweets):,} tweets in {seconds:.1f}s ({len(tweets) / seconds:,.0f} tweets/s)")
+    print(f"  server: {server.stats}")
+    print(f"  client: {hydrator.scheduler.requests} requests, {hydrator.scheduler.throttled} answered 429, {hydrator.scheduler.errors} errors retried")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tweets', type=int, default=20000)
+    parser.add_argument('--tokens', type=int, default=3)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--limit', type=int, default=50, help="requests per token and window")
+    parser.add_argument('--window', type=int, default=5, help="rate limit window in seconds")
+    parser.add_argument('--latency', type=float, default=0.05, help="seconds per request")
+    parser.add_argument('--error-rate', type=float, default=0.01)
+    parser.add_argument('--gzip-error-rate', type=float, default=0.01)
+    args = parser.parse_args()
+
+    ids = list(range(10 ** 18, 10 ** 18 + args.tweets))
+    run(ids, ['token-0'], 1, args)
+    run(ids, [f"token-{i}" for i in range(args.tokens)], args.workers, args)
+
+if __name__ == '__main__':
+    main()
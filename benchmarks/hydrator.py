@@ -0,0 +1,68 @@
+"""Offline stand-in for the Twitter hydrator, returns v1 tweet objects built from the requested ids."""
+from datetime import datetime, timedelta
+import time
+
+# Share of requested tweets that come back, the rest are treated as deleted or protected
+RETURNED = 0.95
+# Number of distinct authors, tweets of the same user repeat its profile
+USERS = 1000
+
+class SyntheticHydrator():
+
+    def __init__(self, latency=0.0, batch=100):
+        # Seconds per API call of 'batch' ids, 0 measures the pipeline alone
+        self.latency = latency
+        self.batch = batch
+
+    def hydrate(self, ids):
+        ids = sorted(int(id) for id in ids)
+        for start in range(0, len(ids), self.batch):
+            if self.latency:
+                time.sleep(self.latency)
+            for id in ids[start:start + self.batch]:
+                if id % 100 < RETURNED * 100:
+                    yield self.tweet(id)
+
+    def tweet(self, id):
+        created_at = datetime(2021, 1, 1) + timedelta(seconds=id % 10000000)
+        user = id % USERS
+        tweet = {
+            'created_at': created_at.strftime('%a %b %d %H:%M:%S +0000 %Y'),
+            'id': id,
+            'id_str': str(id),
+            'full_text': f"Synthetic tweet {id} about the news of the day #data",
+            'truncated': False,
+            'display_text_range': [0, 48],
+            'entities': {'hashtags': [{'text': 'data', 'indices': [42, 47]}], 'symbols': [], 'user_mentions': [], 'urls': []},
+            'source': '<a href="https://mobile.twitter.com" rel="nofollow">Twitter Web App</a>',
+            'in_reply_to_status_id_str': None,
+            'in_reply_to_user_id_str': None,
+            'in_reply_to_screen_name': None,
+            'user': {
+                'id': user,
+                'id_str': str(user),
+                'name': f"User {user}",
+                'screen_name': f"user{user}",
+                'location': '',
+                'url': None,
+                'description': f"Synthetic account {user}",
+                'verified': user % 50 == 0,
+                'followers_count': user * 7,
+                'friends_count': user * 3,
+                'listed_count': user % 11,
+                'favourites_count': user * 5,
+                'statuses_count': user * 13,
+                'geo_enabled': False,
+                'created_at': 'Mon Jan 04 10:00:00 +0000 2010',
+            },
+            'coordinates': None,
+            'place': None,
+            'is_quote_status': False,
+            'retweet_count': id % 97,
+            'favorite_count': id % 89,
+            'lang': 'en',
+        }
+        # One tweet in ten is a retweet
+        if id % 10 == 0:
+            tweet['retweeted_status'] = {'id': id - 1, 'id_str': str(id - 1)}
+        return tweet
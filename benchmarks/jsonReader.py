@@ -0,0 +1,85 @@
+"""JSON ingestion: the previous whole-file readJSON against the streaming lib.readJSON, on a JSON array and a JSON lines file.
+
+    python -m benchmarks.jsonReader --rows 1000000
+
+Each reader runs in a process of its own so peak RSS is measured per reader.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+import pandas as pd
+
+from projectManagers.lib import readJSON
+from . import datasets
+from .run import ROOT, peakRSS
+
+def wholeFile(path, encoding):
+    """lib.readJSON before streaming: json.load of the whole file, line by line when it is not one document."""
+    data = []
+    try:
+        with open(path, encoding=encoding) as f:
+            data = json.load(f)
+    except json.JSONDecodeError:
+        try:
+            for line in open(path, 'r'):
+                data.append(json.loads(line))
+        except json.JSONDecodeError:
+            pass
+    return [pd.DataFrame(data)]
+
+def jsonFiles(rows):
+    """The blogposts rows as a JSON array and as JSON lines."""
+    paths = {}
+    for kind, lines in (('array', False), ('lines', True)):
+        path = os.path.join(datasets.DATA_DIR, f"blogposts_{rows}_{kind}.json")
+        paths[kind] = path
+        if os.path.exists(path):
+            continue
+        os.makedirs(datasets.DATA_DIR, exist_ok=True)
+        with open(f"{path}.tmp", 'w', encoding='utf-8') as f:
+            f.write('' if lines else '[')
+            for i, df in enumerate(datasets.frames(datasets.reflected.tables['blogposts'], rows)):
+                text = df.to_json(orient='records', lines=lines, date_format='iso')
+                f.write(text if lines else ('' if i == 0 else ',') + text[1:-1])
+            f.write('' if lines else ']')
+        os.replace(f"{path}.tmp", path)
+    return paths
+
+def measure(reader, path, chunksize):
+    start = time.perf_counter()
+    chunks = wholeFile(path, 'utf-8') if reader == 'whole' else readJSON(path, 'utf-8', chunksize)
+    rows = sum(df.shape[0] for df in chunks)
+    seconds = time.perf_counter() - start
+    return {'rows': rows, 'seconds': seconds, 'rows_per_second': rows / seconds if seconds else 0, 'peak_rss_mb': peakRSS()}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--chunksize', type=int, default=10000)
+    parser.add_argument('--child', nargs=2, metavar=('READER', 'PATH'), help=argparse.SUPPRESS)
+    parser.add_argument('--prepare', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(measure(*args.child, args.chunksize)))
+        return
+    if args.prepare:
+        print(json.dumps(jsonFiles(args.rows)))
+        return
+
+    # Generated in another process, ru_maxrss of a child includes the memory its parent had when it was forked
+    command = [sys.executable, '-m', 'benchmarks.jsonReader', '--prepare', '--rows', str(args.rows)]
+    paths = json.loads(subprocess.run(command, cwd=ROOT, capture_output=True, text=True, check=True).stdout)
+    for kind, path in paths.items():
+        print(f"{kind} ({os.path.getsize(path) / 1024 ** 2:,.0f}MB)")
+        for reader in ('whole', 'streaming'):
+            command = [sys.executable, '-m', 'benchmarks.jsonReader', '--child', reader, path, '--chunksize', str(args.chunksize)]
+            result = json.loads(subprocess.run(command, cwd=ROOT, capture_output=True, text=True, check=True).stdout)
+            print(f"  {reader:<10} {result['rows']:>10,} rows {result['rows_per_second']:>12,.0f} rows/s {result['peak_rss_mb']:>8.0f}MB peak RSS")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,256 @@
+"""End to end benchmarks of the manager/handler paths against synthetic SQLite data.
+
+    python -m benchmarks.run --rows 100000
+    python -m benchmarks.run --rows 1000000 --scenarios videos reflected --set bulk=false --set writers=2
+    python -m benchmarks.run --compare benchmarks/results/<rev a>.json benchmarks/results/<rev b>.json
+
+Each scenario runs in a process of its own so peak RSS is measured per path.
+Results are written to benchmarks/results/<git rev>.json, one file per commit, to be diffed or compared.
+"""
+from datetime import datetime
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from sqlalchemy import text
+from sqlalchemy.orm import sessionmaker
+
+from . import datasets
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, 'benchmarks', 'results')
+
+# Same keys as main.py, pointed at local files and without resumable state between runs
+SETTINGS = {
+    'production': False,
+    'commit': True,
+    'update': True,
+    'bulk': True,
+    'upsert': False,
+    'prefetch': 2,
+    'writers': 1,
+    'checkpoints': None,
+    'resume': False,
+    'stream': False,
+    'bloom_filters': None,
+    'staging_dedup': False,
+    'adaptive_chunks': None,
+    'report': None,
+    'prometheus': None,
+    'file_workers': 0,
+    'arrow': False,
+    'chunksize': 10000,
+}
+
+YOUTUBE_SCENARIOS = {
+    'videos': 'VideosHandler',
+    'comments': 'CommentsHandler',
+    'videos_daily': 'VideosDailyHandler',
+    'channels_daily': 'ChannelsDailyHandler',
+    'related_videos': 'RelatedVideosHandler',
+}
+SCENARIOS = list(YOUTUBE_SCENARIOS) + ['reflected', 'file', 'parquet', 'directory', 'posts']
+
+def prepare(scenario, rows):
+    """Generates (or reuses) the source data of a scenario, before any timing starts."""
+    if scenario in YOUTUBE_SCENARIOS:
+        from projectManagers.handlers.youtubeHandler import Base
+        return datasets.database('youtube', Base.metadata, rows)
+    if scenario == 'reflected':
+        return datasets.database('blogtrackers', datasets.reflected, rows, sizes={'blogsites': max(rows // 100, 1)})
+    if scenario == 'file':
+        return datasets.csvFile('blogposts', datasets.reflected.tables['blogposts'], rows)
+    if scenario == 'parquet':
+        return datasets.parquetFile('blogposts', datasets.reflected.tables['blogposts'], rows)
+    if scenario == 'directory':
+        return datasets.csvDirectory('blogposts', datasets.reflected.tables['blogposts'], rows)
+    if scenario == 'posts':
+        return datasets.tweetIds(rows)
+    raise ValueError(f"Unknown scenario '{scenario}'")
+
+def buildHandler(scenario, source, meta):
+    """Creates the empty target schema and the handler of a scenario."""
+    from projectManagers import handlers
+    if scenario in YOUTUBE_SCENARIOS:
+        handlers.youtubeHandler.Base.metadata.create_all(meta['target_engine'])
+        meta['source_engine'] = datasets.sqliteEngine(source)
+        meta['source_session'] = sessionmaker(bind=meta['source_engine'])()
+        meta['tracker_id'] = 0
+        meta['last_update'] = None
+        return getattr(handlers, YOUTUBE_SCENARIOS[scenario])(meta)
+    if scenario == 'reflected':
+        datasets.reflected.create_all(meta['target_engine'])
+        meta['source_engine'] = datasets.sqliteEngine(source)
+        return handlers.TableToTableHandler(meta, table='blogposts')
+    if scenario in ('file', 'parquet'):
+        datasets.reflected.create_all(meta['target_engine'])
+        return handlers.FileToDatabaseHandler(meta, 'blogposts', file=source)
+    if scenario == 'directory':
+        datasets.reflected.create_all(meta['target_engine'])
+        return handlers.FileToDatabaseHandler(meta, 'blogposts', dir=source)
+    if scenario == 'posts':
+        from .hydrator import SyntheticHydrator
+        handlers.twitterHandler.Base.metadata.create_all(meta['target_engine'])
+        # Hydrate and write instead of dumping the seed ids
+        handlers.twitterHandler.OUTPUT_IDS = False
+        meta['dir'] = source
+        handler = handlers.PostsHandler(meta, 0)
+        handler.hydrator = SyntheticHydrator(latency=meta.get('hydrator_latency', 0.0))
+        return handler
+
+def peakRSS():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024 ** 2 if sys.platform == 'darwin' else rss / 1024
+
+def runScenario(scenario, rows, overrides):
+    from projectManagers.baseManager import BaseManager
+
+    class BenchmarkManager(BaseManager):
+        TableHandlers = {}
+
+    source = prepare(scenario, rows)
+    with tempfile.TemporaryDirectory() as tmp:
+        meta = dict(SETTINGS, **overrides)
+        meta['target_engine'] = datasets.sqliteEngine(os.path.join(tmp, 'target.db'))
+        handler = buildHandler(scenario, source, meta)
+        manager = BenchmarkManager(meta)
+        manager.TableHandlers[handler.getTableName()] = handler
+        start = time.time()
+        manager.run()
+        seconds = time.time() - start
+        table = handler.getTableName()
+        with meta['target_engine'].connect() as connection:
+            written = connection.execute(text(f"SELECT COUNT(*) FROM {table}")).scalar()
+        stages = meta['metrics'].summary().get(table, {})
+    return {
+        'rows': written,
+        'seconds': seconds,
+        'rows_per_second': written / seconds if seconds else 0,
+        'peak_rss_mb': peakRSS(),
+        'stages': {stage: stages.get(stage, 0) for stage in ('read', 'format', 'build', 'execute', 'commit')},
+        'retries': stages.get('retries', 0),
+        'fallbacks': stages.get('fallbacks', 0),
+    }
+
+def unavailable(scenario):
+    """Why a scenario cannot run in this checkout, None when it can."""
+    if scenario == 'posts':
+        # The hydrators of twitterHandler are not part of every checkout
+        try:
+            import projectManagers.handlers.twitterUtils
+            import projectManagers.handlers.twitterUtils2
+        except ImportError as e:
+            return f"{type(e).__name__}: {e}"
+    return None
+
+def runChild(scenario, rows, overrides):
+    """Runs one scenario in a fresh interpreter, failures are recorded rather than stopping the suite."""
+    with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as f:
+        output = f.name
+    command = [sys.executable, '-m', 'benchmarks.run', '--child', scenario, '--rows', str(rows), '--output', output, '--overrides', json.dumps(overrides)]
+    try:
+        process = subprocess.run(command, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        if process.returncode != 0:
+            return {'error': process.stderr.strip().splitlines()[-1] if process.stderr.strip() else f"exit code {process.returncode}"}
+        with open(output) as f:
+            return json.load(f)
+    finally:
+        os.remove(output)
+
+def gitRevision():
+    def git(*args):
+        return subprocess.run(['git', *args], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    revision = git('rev-parse', '--short', 'HEAD') or 'unknown'
+    # Uncommitted changes would make the results unreproducible from the revision alone
+    dirty = git('status', '--porcelain', '--untracked-files=no')
+    return f"{revision}-dirty" if dirty else revision
+
+def parseOverride(value):
+    key, _, raw = value.partition('=')
+    try:
+        return key, json.loads(raw)
+    except ValueError:
+        return key, raw
+
+def compare(old_path, new_path):
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    print(f"{'scenario':<16}{old['revision']:>16}{new['revision']:>16}{'change':>10}{'rss a':>10}{'rss b':>10}")
+    for scenario in sorted(set(old['scenarios']) | set(new['scenarios'])):
+        a, b = old['scenarios'].get(scenario, {}), new['scenarios'].get(scenario, {})
+        a_rate, b_rate = a.get('rows_per_second'), b.get('rows_per_second')
+        change = f"{(b_rate - a_rate) / a_rate:+.1%}" if a_rate and b_rate else '-'
+        def rate(result, value):
+            return f"{value:,.0f}/s" if value else result.get('error', result.get('skipped', 'missing'))[:15]
+        print(f"{scenario:<16}{rate(a, a_rate):>16}{rate(b, b_rate):>16}{change:>10}{a.get('peak_rss_mb', 0):>9.0f}M{b.get('peak_rss_mb', 0):>9.0f}M")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=10000, help="rows per source table (1e4 to 1e7)")
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument('--set', action='append', default=[], metavar='KEY=VALUE', help="overrides a setting, values are parsed as JSON")
+    parser.add_argument('--output', help="results file, defaults to benchmarks/results/<git rev>.json")
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'))
+    parser.add_argument('--child', choices=SCENARIOS, help=argparse.SUPPRESS)
+    parser.add_argument('--prepare', choices=SCENARIOS, help=argparse.SUPPRESS)
+    parser.add_argument('--overrides', default='{}', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.compare:
+        return compare(*args.compare)
+    if args.prepare:
+        prepare(args.prepare, args.rows)
+        return
+    if args.child:
+        try:
+            result = runScenario(args.child, args.rows, json.loads(args.overrides))
+        except Exception as e:
+            result = {'error': f"{type(e).__name__}: {str(e).strip().splitlines()[0] if str(e).strip() else ''}"}
+        with open(args.output, 'w') as f:
+            json.dump(result, f)
+        return
+
+    overrides = dict(parseOverride(value) for value in args.set)
+    revision = gitRevision()
+    results = {
+        'revision': revision,
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'rows': args.rows,
+        'settings': dict(SETTINGS, **overrides),
+        'scenarios': {},
+    }
+    for scenario in args.scenarios:
+        reason = unavailable(scenario)
+        if reason:
+            results['scenarios'][scenario] = {'skipped': reason}
+            print(f"Skipping {scenario}: {reason}")
+            continue
+        print(f"Generating {scenario} data ({args.rows:,} rows)...")
+        # Generated in another process, ru_maxrss of a child includes the memory its parent had when it was forked
+        subprocess.run([sys.executable, '-m', 'benchmarks.run', '--prepare', scenario, '--rows', str(args.rows)], cwd=ROOT, check=True)
+        print(f"Running {scenario}...")
+        result = runChild(scenario, args.rows, overrides)
+        results['scenarios'][scenario] = result
+        print(f"  {result['error']}" if 'error' in result else f"  {result['rows_per_second']:,.0f} rows/s, peak RSS {result['peak_rss_mb']:.0f}MB")
+    output = args.output or os.path.join(RESULTS_DIR, f"{revision}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=4, sort_keys=True)
+    print(f"Results written to {output}")
+    failed = [scenario for scenario, result in results['scenarios'].items() if 'error' in result]
+    if failed:
+        print(f"Failed scenarios: {', '.join(failed)}")
+        return 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,123 @@
+"""Local stand-in for the statuses/lookup endpoint.
+
+Answers with synthetic tweets and x-rate-limit-* headers per bearer token, 429s once a token's quota is used,
+and can inject bursts of 5xx responses and corrupted gzip bodies.
+
+    python -m benchmarks.twitterServer --port 8000 --limit 300 --window 900
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from urllib.parse import parse_qs
+import argparse
+import gzip
+import json
+import random
+import time
+
+from .hydrator import SyntheticHydrator
+
+class LookupServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port=0, tokens=None, limit=300, window=900, latency=0.0, error_rate=0.0, burst=3, gzip_error_rate=0.0, seed=0):
+        super().__init__(('127.0.0.1', port), LookupHandler)
+        # Tokens accepted, any token is accepted when None
+        self.tokens = tokens
+        self.limit = limit
+        self.window = window
+        self.latency = latency
+        # Chance that a request starts a burst of 'burst' 503 responses
+        self.error_rate = error_rate
+        self.burst = burst
+        self.gzip_error_rate = gzip_error_rate
+        self.random = random.Random(seed)
+        self.hydrator = SyntheticHydrator()
+        self.lock = Lock()
+        self.used = {}
+        self.failing = 0
+        self.stats = {'requests': 0, 'tweets': 0, 'throttled': 0, 'errors': 0, 'gzip_errors': 0, 'rejected': 0}
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/1.1/statuses/lookup.json"
+
+    def start(self):
+        Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def answer(self, token):
+        """Status code and rate limit headers of the next request of 'token'."""
+        with self.lock:
+            self.stats['requests'] += 1
+            if self.tokens is not None and token not in self.tokens:
+                self.stats['rejected'] += 1
+                return 401, {}
+            now = time.time()
+            start = now - now % self.window
+            used = self.used.get(token)
+            used = used if used and used[0] == start else [start, 0]
+            self.used[token] = used
+            headers = {'x-rate-limit-limit': self.limit, 'x-rate-limit-reset': int(start + self.window)}
+            if used[1] >= self.limit:
+                self.stats['throttled'] += 1
+                return 429, dict(headers, **{'x-rate-limit-remaining': 0})
+            used[1] += 1
+            headers['x-rate-limit-remaining'] = self.limit - used[1]
+            if not self.failing and self.random.random() < self.error_rate:
+                self.failing = self.burst
+            if self.failing:
+                self.failing -= 1
+                self.stats['errors'] += 1
+                return 503, headers
+            if self.random.random() < self.gzip_error_rate:
+                self.stats['gzip_errors'] += 1
+                return 'gzip', headers
+            return 200, headers
+
+class LookupHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode()
+        ids = parse_qs(body).get('id', [''])[0].split(',')
+        token = self.headers.get('Authorization', '').replace('Bearer ', '')
+        status, headers = self.server.answer(token)
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if status == 200:
+            tweets = list(self.server.hydrator.hydrate(id for id in ids if id))
+            with self.server.lock:
+                self.server.stats['tweets'] += len(tweets)
+            payload = gzip.compress(json.dumps(tweets).encode())
+        elif status == 'gzip':
+            # Declared as gzip but not deflate data, clients fail while decoding it
+            status, payload = 200, gzip.compress(b'[]')[:10] + b'corrupted body'
+        else:
+            payload = gzip.compress(json.dumps({'errors': [{'code': status, 'message': 'stand-in error'}]}).encode())
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, str(value))
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--limit', type=int, default=300)
+    parser.add_argument('--window', type=int, default=900)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--gzip-error-rate', type=float, default=0.0)
+    args = parser.parse_args()
+    server = LookupServer(args.port, limit=args.limit, window=args.window, latency=args.latency, error_rate=args.error_rate, gzip_error_rate=args.gzip_error_rate)
+    print(f"Serving {server.url}")
+    server.serve_forever()
+
+if __name__ == '__main__':
+    main()
@@ -17,6 +17,51 @@ def main():
         # If update is False and no logic is defined for duplicate entries an error will be raised.
         # Be careful with updating composite keys that include dates.
         'update': True,
+        # If bulk is True, handlers that support it write rows with Core executemany instead of ORM objects.
+        # Duplicates are then updated with bulk update mappings when 'update' is ON, without building ORM objects either.
+        'bulk': True,
+        # If upsert is True, bulk writes use INSERT ... ON DUPLICATE KEY UPDATE (ON CONFLICT on SQLite).
+        # Only the handler's update columns are overwritten, primary keys never are.
+        'upsert': False,
+        # Number of chunks read ahead by a background reader while the current chunk is written. 0 reads serially.
+        'prefetch': 2,
+        # Number of concurrent writers per table. Rows are partitioned by primary key hash, each writer has its own connection.
+        'writers': 1,
+        # Progress of each handler is recorded in this file after every committed chunk.
+        'checkpoints': 'checkpoints.jsonl',
+        # If resume is True, handlers interrupted in a previous run pick up after their last committed chunk.
+        'resume': True,
+        # If stream is True, source reads use server-side cursors so memory is bounded by the chunk size.
+        'stream': True,
+        # If set, existing ids of very large tables are kept in on-disk Bloom filters in this folder instead of memory.
+        'bloom_filters': None,
+        # If staging_dedup is True, each chunk's ids are staged in a temporary table and the target returns the new ones.
+        'staging_dedup': False,
+        # If dedup_files is True, ids sent from a file are also skipped when they appear again in later chunks and files.
+        'dedup_files': False,
+        # If set, chunk sizes adapt to the measured latency and memory of each table and are saved to this file.
+        'adaptive_chunks': None,
+        # Per table and per chunk stage timings are written to this JSON report and Prometheus textfile after a run.
+        'report': 'run_report.json',
+        'prometheus': 'datasync.prom',
+        # Concurrent tweet lookups when bearer tokens are listed under 'twitter_tokens' in credentials.yml, used in rotation.
+        'hydration_workers': 8,
+        # Hydrated tweets are kept compressed in this folder, re-runs only query the API for ids it does not hold. None disables it.
+        'tweet_cache': 'tweet_cache',
+        # Seconds ids the API did not return (deleted or protected tweets) are not requested again from the tweet cache.
+        'missing_ttl': 86400,
+        # If set, tweet ids written by the Twitter handler are saved to this folder and reloaded instead of querying the posts table.
+        'seen_ids': None,
+        # Number of recent Twitter users whose profile hash is kept, users whose profile did not change are not rewritten.
+        'user_cache_size': 1000000,
+        # If set, the profile hashes are saved to this file and reused by the next run.
+        'user_hashes': None,
+        # Number of worker processes parsing and formatting the files of a directory in parallel. 0 or 1 reads them one at a time.
+        'file_workers': 0,
+        # If arrow is True and pyarrow is installed, csv and json lines files are parsed by pyarrow on several threads. Parquet and feather files always need pyarrow.
+        'arrow': False,
+        # Sheet read from xlsx files, by name or position. None reads the first one.
+        'excel_sheet': None,
         'dbs': credentials,
     }
 
@@ -1,18 +1,39 @@
 from sqlalchemy.orm import sessionmaker
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from time import time
+import numpy as np
+import pandas as pd
+from .checkpoints import CheckpointStore
+from .chunker import AdaptiveChunker
+from .lib import prefetch
+from .metrics import RunMetrics
 
 class BaseManager():
     TableHandlers = {}
 
     def __init__(self, meta):
         self.meta = meta
-        Session = sessionmaker()
-        Session.configure(bind=meta['target_engine'])
-        self.target_session = Session()
+        self.Session = sessionmaker()
+        self.Session.configure(bind=meta['target_engine'])
+        self.target_session = self.new_session()
         self.meta['target_session'] = self.target_session
+        # Prefetching readers run getData in their own thread, target lookups they make need a separate session
+        if self.meta.get('prefetch', 0):
+            self.read_session = self.new_session()
+            self.meta['read_session'] = self.read_session
+        if self.meta.get('checkpoints'):
+            self.meta['checkpoint_store'] = CheckpointStore(self.meta['checkpoints'])
+        if self.meta.get('adaptive_chunks') and 'chunksize' in self.meta:
+            # Prefetched chunks, the one being formatted and the one being written are all in memory at once
+            in_flight = self.meta.get('prefetch', 0) + 1 + (1 if self.meta.get('writers', 1) > 1 else 0)
+            self.meta['chunker'] = AdaptiveChunker(self.meta['adaptive_chunks'], self.meta['chunksize'], in_flight)
+        self.meta['metrics'] = RunMetrics()
 
     def __del__(self):
         self.target_session.close()
+        if 'read_session' in self.meta:
+            self.meta['read_session'].close()
 
     def __len__(self):
         return len(self.TableHandlers)
@@ -21,18 +42,162 @@ class BaseManager():
         for table in self.TableHandlers:
             yield self.TableHandlers[table]
 
+    def new_session(self):
+        return self.Session()
+
     def run(self):
         for handler in self:
             self.transfer(handler)
+        self.report()
+
+    def report(self):
+        if self.meta.get('report'):
+            self.meta['metrics'].writeReport(self.meta['report'])
+        if self.meta.get('prometheus'):
+            self.meta['metrics'].writePrometheus(self.meta['prometheus'])
 
-    def transfer(self, handler):
+    def transfer(self, handler, session=None):
+        session = session if session is not None else self.target_session
         print(f"Starting Table {handler.getTableName()} at {datetime.now()}")
-        with self.target_session.no_autoflush:
-            for df in handler.getData():
-                df = handler.format_data(df)
-                dict_items = df.to_dict(orient='records')
-                items = [handler.build(**kwargs) for kwargs in dict_items]
-                handler.execute(self.target_session, items, dict_items)
+        writers = self.meta.get('writers', 1)
+        writer = PartitionedWriter(self, handler, writers) if writers > 1 and handler.supports_bulk else None
+        self.meta['metrics'].begin(handler.getTableName())
+        with session.no_autoflush:
+            try:
+                for df, read_seconds in self.read(handler):
+                    start = time()
+                    # Formatting may return a new frame, the position has to be read first
+                    position = df.attrs.get('checkpoint')
+                    df = handler.format_data(df)
+                    record = {'rows': df.shape[0], 'read': read_seconds, 'format': time() - start}
+                    if writer:
+                        writer.write(df, position, start, record)
+                    else:
+                        stats = self.write(handler, session, df)
+                        self.checkpoint(handler, position)
+                        self.finishChunk(handler, df, record, [stats], time() - start)
+            finally:
+                if writer:
+                    writer.close()
+                if 'chunker' in self.meta:
+                    self.meta['chunker'].save()
+                self.meta['metrics'].finish(handler.getTableName())
             # Execute post-merge operations, if any
-            handler.postOperations(self.target_session)
+            handler.postOperations(session)
+        # A finished handler starts from scratch next time
+        if 'checkpoint_store' in self.meta and self.meta['commit']:
+            self.meta['checkpoint_store'].clear(handler.getCheckpointKey())
+
+    def checkpoint(self, handler, position):
+        # Progress is only recorded once the chunk has been committed
+        if position is not None and 'checkpoint_store' in self.meta and self.meta['commit']:
+            self.meta['checkpoint_store'].save(handler.getCheckpointKey(), position)
+
+    def finishChunk(self, handler, df, record, results, seconds):
+        # Stats of every write the chunk took (one per partition with parallel writers)
+        for stats in results:
+            for key, value in (stats or {}).items():
+                record[key] = record.get(key, 0) + value
+        self.meta['metrics'].record(handler.getTableName(), record)
+        # Latency, throughput and memory of the chunk drive the next chunk sizes
+        if 'chunker' in self.meta and df.shape[0] > 0:
+            self.meta['chunker'].record(handler.getTableName(), df.shape[0], seconds, df.memory_usage(deep=True).sum())
+
+    def read(self, handler):
+        """Chunks of the handler with the seconds the source took to read each of them."""
+        depth = self.meta.get('prefetch', 0)
+        # The next chunks are fetched while the current one is formatted and written, timed in the reader thread
+        if depth:
+            return prefetch(timed(handler.getData()), depth)
+        return timed(handler.getData())
+
+    def write(self, handler, session, df):
+        start = time()
+        dict_items = df.to_dict(orient='records')
+        # Core path: rows go straight into executemany batches without building declarative instances
+        if (self.meta.get('bulk', False) or self.meta.get('upsert', False)) and handler.supports_bulk:
+            stats = handler.execute_bulk(session, dict_items) or {}
+        else:
+            items = [handler.build(**kwargs) for kwargs in dict_items]
+            build = time() - start
+            stats = handler.execute(session, items, dict_items) or {}
+            stats['build'] = build
+        stats['execute'] = time() - start - stats.get('build', 0) - stats.get('commit', 0)
+        return stats
+
+def timed(chunks):
+    # Time spent reading each chunk from the source
+    try:
+        while True:
+            start = time()
+            try:
+                chunk = next(chunks)
+            except StopIteration:
+                return
+            yield chunk, time() - start
+    finally:
+        chunks.close()
+
+
+class PartitionedWriter():
+    """Fans chunks out to K writers, each with its own session. Rows are partitioned by a hash of
+    the primary key so no two writers ever touch the same key."""
+
+    def __init__(self, manager, handler, writers):
+        self.manager = manager
+        self.handler = handler
+        self.sessions = [manager.new_session() for i in range(writers)]
+        self.pool = ThreadPoolExecutor(max_workers=writers)
+        self.pending = []
+        self.position = None
+        self.df = None
+        self.start = None
+        self.record = None
+        self.rows = [0] * writers
+        self.seconds = [0.0] * writers
+
+    def partition(self, df):
+        pks = [c.name for c in self.handler.Mapper.__table__.primary_key.columns]
+        # Keys generated by the database (e.g. autoincrement ids) cannot collide, rows are spread evenly
+        if not all(pk in df.columns for pk in pks):
+            return np.arange(df.shape[0]) % len(self.sessions)
+        return (pd.util.hash_pandas_object(df[pks], index=False) % len(self.sessions)).values
+
+    def write(self, df, position=None, start=None, record=None):
+        partitions = self.partition(df)
+        # A writer's session must not be used by two chunks at once
+        self.wait()
+        self.position = position
+        self.df = df
+        self.start = start if start is not None else time()
+        self.record = record if record is not None else {'rows': df.shape[0]}
+        self.pending = [self.pool.submit(self.writePartition, i, df[partitions == i]) for i in range(len(self.sessions))]
+
+    def writePartition(self, i, df):
+        if df.shape[0] == 0:
+            return
+        start = time()
+        with self.sessions[i].no_autoflush:
+            stats = self.manager.write(self.handler, self.sessions[i], df)
+        self.seconds[i] += time() - start
+        self.rows[i] += df.shape[0]
+        return stats
+
+    def wait(self):
+        results = [future.result() for future in self.pending]
+        # Every partition of the previous chunk is written
+        if self.pending:
+            self.manager.checkpoint(self.handler, self.position)
+            self.manager.finishChunk(self.handler, self.df, self.record, results, time() - self.start)
+        self.pending = []
 
+    def close(self):
+        try:
+            self.wait()
+        finally:
+            self.pool.shutdown()
+            for session in self.sessions:
+                session.close()
+        for i in range(len(self.sessions)):
+            rate = self.rows[i] / self.seconds[i] if self.seconds[i] else 0
+            print(f"{self.handler.getTableName()} writer {i}: {self.rows[i]} rows in {self.seconds[i]:.1f}s ({rate:.0f} rows/s)")
@@ -0,0 +1,72 @@
+from datetime import date, datetime, time
+from decimal import Decimal
+from json import JSONDecodeError
+from threading import Lock
+import json
+import os
+
+# Positions may hold primary key values JSON has no type for, they are written as {tag: text}
+TYPES = {'$datetime': datetime, '$date': date, '$time': time, '$decimal': Decimal}
+
+def encode(value):
+    # datetime is a subclass of date, it has to be tested first
+    for tag, kind in TYPES.items():
+        if isinstance(value, kind):
+            return {tag: str(value) if kind is Decimal else value.isoformat()}
+    if isinstance(value, bytes):
+        return {'$bytes': value.hex()}
+    raise TypeError(f"Cannot store {type(value).__name__} values in a checkpoint")
+
+def decode(record):
+    if len(record) == 1:
+        tag, value = next(iter(record.items()))
+        if tag == '$bytes':
+            return bytes.fromhex(value)
+        if tag == '$decimal':
+            return Decimal(value)
+        if tag in TYPES:
+            return TYPES[tag].fromisoformat(value)
+    return record
+
+def dumps(record):
+    return json.dumps(record, default=encode)
+
+class CheckpointStore():
+    """Per-handler progress stored as JSON lines. The last line written for a key wins."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = Lock()
+        self.positions = {}
+        if os.path.isfile(path):
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line, object_hook=decode)
+                    # A crash while writing leaves a partial last line
+                    except JSONDecodeError:
+                        continue
+                    self.positions[record['key']] = record['position']
+        # Compact the log so it only holds the current position of unfinished handlers
+        self.positions = {key: position for key, position in self.positions.items() if position is not None}
+        with open(path, 'w', encoding='utf-8') as f:
+            for key, position in self.positions.items():
+                f.write(dumps({'key': key, 'position': position}) + "\n")
+        self.file = open(path, 'a', encoding='utf-8')
+
+    def __del__(self):
+        self.file.close()
+
+    def get(self, key):
+        return self.positions.get(key)
+
+    def save(self, key, position):
+        with self.lock:
+            self.positions[key] = position
+            self.file.write(dumps({'key': key, 'position': position}) + "\n")
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def clear(self, key):
+        if key in self.positions:
+            self.save(key, None)
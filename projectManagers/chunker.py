@@ -0,0 +1,46 @@
+from threading import Lock
+import json
+import os
+
+# Chunk sizes are kept within these bounds
+MIN_CHUNK_SIZE = 1000
+MAX_CHUNK_SIZE = 500000
+# Time a chunk should take to be formatted and written
+TARGET_SECONDS = 5
+# Memory all chunks in flight (prefetched and being written) may use together
+MAX_BYTES = 1024 ** 3
+
+class AdaptiveChunker():
+    """Per-table chunk sizes that grow or shrink from the measured latency, throughput and memory of each chunk.
+    Learned sizes are saved so the next run starts from them."""
+
+    def __init__(self, path, default, in_flight=1):
+        self.path = path
+        self.default = default
+        self.in_flight = in_flight
+        self.lock = Lock()
+        self.sizes = {}
+        if os.path.isfile(path):
+            with open(path, encoding='utf-8') as f:
+                self.sizes = json.load(f)
+
+    def size(self, table):
+        return self.sizes.get(table, self.default)
+
+    def record(self, table, rows, seconds, nbytes):
+        if rows == 0 or seconds <= 0:
+            return
+        with self.lock:
+            size = self.size(table)
+            # Rows that can be written within the target latency at the measured rows/sec
+            latency_rows = rows / seconds * TARGET_SECONDS
+            # Rows that keep every chunk in flight under the memory ceiling
+            memory_rows = MAX_BYTES / (nbytes / rows) / self.in_flight
+            # Damped so a single slow or fast chunk moves the size at most by a factor of 2, the memory ceiling is not
+            target = min(max(size / 2, min(size * 2, latency_rows)), memory_rows)
+            self.sizes[table] = int(max(MIN_CHUNK_SIZE, min(MAX_CHUNK_SIZE, target)))
+
+    def save(self):
+        with self.lock:
+            with open(self.path, 'w', encoding='utf-8') as f:
+                json.dump(self.sizes, f, indent=4)
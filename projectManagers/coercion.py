@@ -0,0 +1,69 @@
+from sqlalchemy import Date, DateTime, Integer, JSON, Numeric
+import json
+import pandas as pd
+
+MIXED_FORMATS = int(pd.__version__.split('.')[0]) >= 2
+
+class CoercionPlan():
+    """Conversions of each column to its target type, derived once from the table's columns and applied to every chunk.
+    Plain lists of column names, so a plan can be sent to worker processes."""
+
+    def __init__(self, table=None):
+        columns = list(table.columns) if table is not None else []
+        self.datetimes = [c.name for c in columns if isinstance(c.type, (DateTime, Date))]
+        self.integers = [c.name for c in columns if isinstance(c.type, Integer)]
+        self.numbers = [c.name for c in columns if isinstance(c.type, Numeric)]
+        self.json = [c.name for c in columns if isinstance(c.type, JSON)]
+
+    def apply(self, df):
+        if df.shape[0] == 0:
+            return df
+        # Only text read from files needs parsing, columns read from a database already have their types
+        for col in present(self.json, df, 'object'):
+            df[col] = parseJSON(df[col])
+        for col in present(self.integers + self.numbers, df, 'object'):
+            df[col] = toNumber(df[col], integer=col in self.integers)
+        datetimes = set(present(self.datetimes, df)) | set(df.select_dtypes(include=['datetime', 'datetimetz']).columns)
+        # Defaults any 'nan' values to 0 for numeric fields. This is because MySQL will not accept 'nan' fields.
+        numeric = df.select_dtypes(include='number').columns
+        if len(numeric):
+            df = df.fillna({col: 0 for col in numeric})
+        for col in datetimes:
+            df[col] = toDatetime(df[col])
+        return df
+
+def present(columns, df, dtype=None):
+    return [col for col in columns if col in df.columns and (dtype is None or df[col].dtype == dtype)]
+
+def toDatetime(series):
+    """Native, timezone naive (UTC) datetimes truncated to the second, missing values become None."""
+    parsed = pd.to_datetime(series, errors='coerce', utc=True)
+    # pandas 2 infers one format from the first value, text mixing formats is parsed value by value instead
+    if MIXED_FORMATS and parsed.isna().sum() > series.isna().sum() + (series == '').sum():
+        parsed = pd.to_datetime(series, errors='coerce', utc=True, format='mixed')
+    series = parsed.dt.tz_convert(None).dt.floor('s')
+    return series.astype(object).where(series.notna(), None)
+
+def toNumber(series, integer=False):
+    series = pd.to_numeric(series, errors='coerce')
+    # Nullable ints keep integer columns integral when some values are missing
+    if integer and (series.dropna() % 1 == 0).all():
+        return series.astype('Int64')
+    return series
+
+def parseJSON(series):
+    """Parses every JSON string of a column. Unparsable columns are left as they are."""
+    text = series.map(type) == str
+    empty = text & (series == '')
+    strings = text & ~empty
+    if not strings.any():
+        return series
+    values = series[strings]
+    # Each value is parsed on its own, values joined into one document could split or merge across commas
+    try:
+        parsed = [json.loads(value) for value in values]
+    except ValueError:
+        return series
+    result = series.astype(object).where(series.notna() & ~empty, None)
+    result[strings] = pd.Series(parsed, index=values.index, dtype=object)
+    return result
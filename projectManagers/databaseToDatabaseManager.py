@@ -2,6 +2,8 @@ from .baseManager import BaseManager
 from .handlers import TableToTableHandler
 from .lib import get_engine
 
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from graphlib import TopologicalSorter, CycleError
 from sqlalchemy.ext.automap import automap_base
 
 class DatabaseToDatabaseManager(BaseManager):
@@ -10,10 +12,23 @@ class DatabaseToDatabaseManager(BaseManager):
 
         meta = settings.copy()
         meta['chunksize'] = 10000
+        # Number of tables transferred concurrently. Parent tables always finish before their children start.
+        meta['workers'] = 4
+        # Read source tables by primary key pages instead of one SELECT * buffered in client memory
+        meta['keyset'] = True
+        # Only re-copy the primary key ranges whose checksums differ between source and target (MySQL only)
+        meta['differential'] = False
+        if meta['differential']:
+            meta['upsert'] = True
 
+        # Each worker reads the source over its own connection, plus one for reflection and keyset lookups
+        source_pool_size = max(5, 2 * meta['workers'])
+        # On the target each worker holds its writer and lookup sessions, one session per partitioned writer
+        # and the connection of a staging id index
+        target_pool_size = max(5, meta['workers'] * (meta.get('writers', 1) + 3))
         meta['dbs']['cosmos_1']['database'] = 'blogtrackers'
-        meta['source_engine'] = get_engine(meta['dbs']['cosmos_1'])
-        meta['target_engine'] = get_engine(meta['dbs']['bt_vm'])
+        meta['source_engine'] = get_engine(meta['dbs']['cosmos_1'], pool_size=source_pool_size)
+        meta['target_engine'] = get_engine(meta['dbs']['bt_vm'], pool_size=target_pool_size)
 
         super().__init__(meta)
 
@@ -23,16 +38,54 @@ class DatabaseToDatabaseManager(BaseManager):
         Base = automap_base()
         Base.prepare(meta['source_engine'], reflect=True)
 
-        relationships = {}
+        self.dependencies = {}
 
         for t in Base.classes:
             tableName = t.__table__.name
-            self.TableHandlers[tableName] = TableToTableHandler(meta, table=tableName)
-            relationships[tableName] = []
-            relationships[tableName].extend(t.__mapper__.relationships.keys())
+            # Each handler gets its own meta so a worker can bind its own sessions to it
+            self.TableHandlers[tableName] = TableToTableHandler(meta.copy(), table=tableName)
+            # Tables referenced by foreign keys are parents and must be transferred first
+            self.dependencies[tableName] = {fk.column.table.name for fk in t.__table__.foreign_keys} - {tableName}
 
         # self.TableHandlers = {'blogsites': self.TableHandlers['blogsites']}
 
-        print(relationships)
+        print(self.dependencies)
 
         # self.TableHandlers = {'blogposts': TableToTableHandler(meta, table='blogposts', query_pk=True)}
+
+    def run(self):
+        if self.meta['workers'] <= 1:
+            return super().run()
+        # Only schedule against tables that are actually transferred
+        graph = {table: self.dependencies.get(table, set()) & self.TableHandlers.keys() for table in self.TableHandlers}
+        schedule = TopologicalSorter(graph)
+        try:
+            schedule.prepare()
+        except CycleError as e:
+            print(f"Circular foreign keys between {e.args[1]}, transferring tables one after another.")
+            return super().run()
+        with ThreadPoolExecutor(max_workers=self.meta['workers']) as pool:
+            running = {}
+            while schedule.is_active():
+                for table in schedule.get_ready():
+                    running[pool.submit(self.transferTable, table)] = table
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    table = running.pop(future)
+                    future.result()
+                    # Children of this table can start now
+                    schedule.done(table)
+        self.report()
+
+    def transferTable(self, table):
+        handler = self.TableHandlers[table]
+        sessions = [self.new_session()]
+        handler.meta['target_session'] = sessions[0]
+        if 'read_session' in handler.meta:
+            sessions.append(self.new_session())
+            handler.meta['read_session'] = sessions[1]
+        try:
+            self.transfer(handler, sessions[0])
+        finally:
+            for session in sessions:
+                session.close()
@@ -1,10 +1,32 @@
-import pickle, tempfile, time
+import os, pickle, tempfile, time
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.exc import IntegrityError, OperationalError, InternalError
 from sqlalchemy.orm.exc import StaleDataError
 from tqdm import tqdm
 
+from ..coercion import CoercionPlan
+from ..idIndex import IdIndex, BloomIdIndex, StagedIdIndex
+
+# Driver error codes of a duplicate key: MySQL ER_DUP_KEY, ER_DUP_ENTRY, ER_DUP_ENTRY_WITH_KEY_NAME and PostgreSQL unique_violation
+DUPLICATE_CODES = (1022, 1062, 1586, '23505')
+
+def isDuplicate(error):
+    """Whether an IntegrityError comes from an existing key, rather than e.g. a NOT NULL or foreign key violation."""
+    orig = error.orig
+    code = getattr(orig, 'pgcode', None) or (orig.args[0] if getattr(orig, 'args', None) else None)
+    # SQLite only tells them apart in the message
+    return code in DUPLICATE_CODES or 'UNIQUE constraint failed' in str(orig)
+
 class BaseHandler():
     __tablename__ = None
+    # Handlers whose rows map 1:1 onto self.Mapper can be written with Core executemany
+    supports_bulk = False
+    # Columns overwritten when an upsert hits an existing key. None means every non primary key column.
+    # Primary key columns (e.g. videos_daily.extracted_date) are never overwritten.
+    update_columns = None
+    # Type conversions of the target table, built on the first chunk
+    plan = None
 
     def __init__(self, meta):
         self.meta = meta
@@ -16,79 +38,183 @@ class BaseHandler():
     def get_target_engine(self):
         return self.meta['target_engine']
 
+    def get_read_session(self):
+        # Lookups made from getData must not share the writer's session when chunks are prefetched
+        return self.meta['read_session'] if 'read_session' in self.meta else self.meta['target_session']
+
+    def newIdIndex(self, name=None):
+        # The target computes which ids are new, nothing is preloaded
+        if self.meta.get('staging_dedup', False):
+            return StagedIdIndex()
+        # Very large tables keep their ids in an on-disk Bloom filter rather than in memory
+        if self.meta.get('bloom_filters'):
+            # Indexes loaded with different conditions need their own file
+            name = f"{self.getTableName()}_{name}" if name else self.getTableName()
+            return BloomIdIndex(os.path.join(self.meta['bloom_filters'], f"{name}.bloom"))
+        return IdIndex()
+
+    def getChunkSize(self):
+        # Adaptive sizes are learned per table
+        if 'chunker' in self.meta:
+            return self.meta['chunker'].size(self.getTableName())
+        return self.meta['chunksize']
+
+    def getCheckpointKey(self):
+        return self.getTableName()
+
+    def getCheckpoint(self):
+        # Position of the last committed chunk, if the previous run was interrupted and 'resume' is ON
+        if self.meta.get('resume', False) and 'checkpoint_store' in self.meta:
+            return self.meta['checkpoint_store'].get(self.getCheckpointKey())
+        return None
+
     def getData(self):
         pass
 
-    def push(self, session):
+    def newStats(self):
+        # Per write counters and commit time, collected into the run metrics. 'failed' is set when the rows were only pickled.
+        return {'splits': 0, 'retries': 0, 'fallbacks': 0, 'failed': 0, 'commit': 0.0}
+
+    def push(self, session, stats=None):
         session.flush()
         if self.meta['commit']:
+            start = time.time()
             session.commit()
+            if stats is not None:
+                stats['commit'] += time.time() - start
+
+    def getPlan(self):
+        if self.plan is None:
+            Mapper = getattr(self, 'Mapper', None)
+            self.plan = CoercionPlan(Mapper.__table__ if Mapper is not None else None)
+        return self.plan
 
     def format_data(self, df):
-        for col in df.select_dtypes(include=['datetime64[ns]', 'datetime64[ns, UTC]']):
-            df[col] = df[col].dt.strftime('%Y-%m-%d %H:%M:%S')
-        # Defaults any 'nan' values to 0 for numeric fields. This is because MySQL will not accept 'nan' fields.
-        for col in df.select_dtypes(include=['int', 'float']):
-            df[col].fillna(0, inplace=True)
-        return df
+        return self.getPlan().apply(df)
 
     def execute(self, session, items, dict_items):
-        # Bulk insert
-        session.add_all(items)
+        def insert():
+            session.add_all(items)
+        def update(batch):
+            # Conflicting items are updated from their attributes
+            session.bulk_update_mappings(self.Mapper, dict_items if batch is items else [vars(item) for item in batch])
+        def write(batch):
+            session.add_all(batch)
+            session.flush()
+        return self.retry(session, items, insert, update, write)
+
+    def retry(self, session, items, insert, update, write):
+        """Writes 'items' with 'insert', server errors are retried. Duplicates are updated when 'update' is ON,
+        a batch mixing new and existing rows is split by isolate, 'write' writing each half."""
+        stats = self.newStats()
         maxTries = 5
         message = ""
         for i in range(0, maxTries):
             try:
                 # Attempts to push bulk insert
-                self.push(session)
-                return
+                insert()
+                self.push(session, stats)
+                return stats
             # Handles duplicates if 'update' is ON
             except IntegrityError as e:
-                if self.meta['update'] is False:
+                if self.meta['update'] is False or not isDuplicate(e):
                     raise e
                 session.rollback()
+                stats['fallbacks'] += 1
                 try:
                     # Attempts to mass update
-                    session.bulk_update_mappings(self.Mapper, dict_items)
-                    self.push(session)
-                    return
+                    update(items)
+                    self.push(session, stats)
+                    return stats
                 # If there was a mix of new and existing rows and mass update fails, split items between inserts and updates
                 except StaleDataError as e:
                     session.rollback()
-                    added_items = []
-                    updated_items = []
-                    for item in tqdm(items, desc='Bulk operations failed, updating items individually', leave=False):
-                        session.add(item)
-                        try:
-                            session.flush()
-                            added_items.append(item)
-                        except IntegrityError:
-                            session.rollback()
-                            updated_items.append(item)
-                        # Try to make OperationalError go up a clause
-                        except Exception as e:
-                            raise e
-                    session.rollback()
-                    session.add_all(added_items)
-                    updated_items = [vars(item) for item in updated_items]
-                    session.bulk_update_mappings(self.Mapper, updated_items)
-                    session.flush()
-                    if self.meta['commit']:
-                        session.commit()
-                    return
+                    stats['fallbacks'] += 1
+                    # Rows written by isolate stay in the transaction
+                    added_items, updated_items = self.isolate(session, items, write, stats)
+                    update(updated_items)
+                    self.push(session, stats)
+                    self.report(stats, len(updated_items))
+                    return stats
             # Accounts for server errors
             except (OperationalError, InternalError)  as e:
                 message = str(e)
             # Log errors and wait before resuming
             print(f"\nError: {message}\nRetry {i+1}...")
             session.rollback()
+            stats['retries'] += 1
             time.sleep(600)
-        # If multiple calls to the server fail, log items
-        with tempfile.NamedTemporaryFile(suffix='pkl') as f:
-            with open("DB_tools.log", "a") as logf:
-                    logf.write("{0}\n".format(message))
+        # If multiple calls to the server fail, log items. The file is kept to replay them.
+        with open("DB_tools.log", "a") as logf:
+            logf.write("{0}\n".format(message))
+        with tempfile.NamedTemporaryFile(suffix='.pkl', delete=False) as f:
             print(f"Pickling {len(items)} items to {f.name}")
             pickle.dump(items, f)
+        stats['failed'] = 1
+        return stats
+
+    def isolate(self, session, batch, write, stats):
+        """Halve a failing batch until the conflicting rows are isolated. Returns (written, conflicting).
+        Each attempt runs in a savepoint, a failing half does not undo the halves already written."""
+        try:
+            with session.begin_nested():
+                write(batch)
+            return batch, []
+        except IntegrityError as e:
+            if not isDuplicate(e):
+                raise e
+            if len(batch) == 1:
+                return [], batch
+            stats['splits'] += 1
+            middle = len(batch) // 2
+            left_added, left_conflicts = self.isolate(session, batch[:middle], write, stats)
+            right_added, right_conflicts = self.isolate(session, batch[middle:], write, stats)
+            return left_added + right_added, left_conflicts + right_conflicts
+
+    def report(self, stats, conflicts):
+        tqdm.write(f"{self.getTableName()}: isolated {conflicts} existing rows in {stats['splits']} splits")
+
+    def get_rows(self, dict_items):
+        # Core inserts only accept keys that are columns of the mapped table
+        columns = [c for c in self.Mapper.__table__.columns.keys() if c in dict_items[0]]
+        return [{c: row[c] for c in columns} for row in dict_items]
+
+    def getUpdateColumns(self, columns):
+        table = self.Mapper.__table__
+        update_columns = self.update_columns if self.update_columns is not None else table.columns.keys()
+        return [c for c in update_columns if c in columns and not table.columns[c].primary_key]
+
+    def upsert_statement(self, session, columns):
+        table = self.Mapper.__table__
+        update_columns = self.getUpdateColumns(columns)
+        dialect = session.get_bind().dialect.name
+        if dialect == 'mysql':
+            stmt = mysql_insert(table)
+            # Nothing to overwrite, existing keys are skipped
+            if not update_columns:
+                return stmt.prefix_with('IGNORE')
+            return stmt.on_duplicate_key_update({c: stmt.inserted[c] for c in update_columns})
+        if dialect == 'sqlite':
+            stmt = sqlite_insert(table)
+            pks = [c.name for c in table.primary_key.columns]
+            if not update_columns:
+                return stmt.on_conflict_do_nothing(index_elements=pks)
+            return stmt.on_conflict_do_update(index_elements=pks, set_={c: stmt.excluded[c] for c in update_columns})
+        # Other dialects go through plain inserts and the update fallback
+        return None
+
+    def execute_bulk(self, session, dict_items):
+        if len(dict_items) == 0:
+            return self.newStats()
+        rows = self.get_rows(dict_items)
+        # With 'upsert' ON, new and existing rows of a batch land in a single statement
+        statement = self.upsert_statement(session, rows[0].keys()) if self.meta.get('upsert', False) else None
+        if statement is None:
+            statement = self.Mapper.__table__.insert()
+        def update(batch):
+            session.bulk_update_mappings(self.Mapper, batch)
+        # Single executemany against the mapped table, no ORM objects are created
+        return self.retry(session, rows, lambda: session.execute(statement, rows), update, lambda batch: session.execute(statement, batch))
 
     def postOperations(self, session=None):
         pass
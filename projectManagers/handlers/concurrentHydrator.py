@@ -0,0 +1,167 @@
+import logging
+import random
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import islice
+from threading import Condition, local
+
+import requests
+from requests.exceptions import ChunkedEncodingError, ConnectionError, ContentDecodingError, ReadTimeout
+
+log = logging.getLogger('hydrator')
+
+LOOKUP_URL = 'https://api.twitter.com/1.1/statuses/lookup.json'
+# Ids per statuses/lookup call
+BATCH_SIZE = 100
+# Quota assumed for a credential until its first response tells the real one (statuses/lookup app auth, 15 minutes)
+DEFAULT_LIMIT = 300
+DEFAULT_WINDOW = 900
+# Seconds added to x-rate-limit-reset, clocks of the API and of this host are never exactly in sync
+RESET_MARGIN = 2
+
+class Credential():
+
+    def __init__(self, token):
+        self.token = token
+        self.limit = DEFAULT_LIMIT
+        self.remaining = DEFAULT_LIMIT
+        self.reset = 0
+        # Requests sent whose response has not been received, the server has not counted them yet
+        self.in_flight = 0
+        self.disabled = False
+
+class TokenScheduler():
+    """Token bucket per credential, refilled from the rate limit headers of each response.
+    Requests wait for a credential with quota left instead of being sent and answered with 429."""
+
+    def __init__(self, tokens):
+        self.credentials = [Credential(token) for token in tokens]
+        self.condition = Condition()
+        self.next = 0
+        self.requests = 0
+        self.throttled = 0
+        self.errors = 0
+
+    def acquire(self):
+        with self.condition:
+            while True:
+                now = time.time()
+                active = [c for c in self.credentials if not c.disabled]
+                if not active:
+                    raise RuntimeError("Every Twitter credential was rejected")
+                # Round robin over the credentials that still have quota in the current window
+                for i in range(len(self.credentials)):
+                    credential = self.credentials[(self.next + i) % len(self.credentials)]
+                    if credential.disabled:
+                        continue
+                    if credential.reset and now >= credential.reset:
+                        # New window, the exact quota comes back with the next response
+                        credential.remaining = credential.limit
+                        credential.reset = 0
+                    if credential.remaining > 0:
+                        credential.remaining -= 1
+                        credential.in_flight += 1
+                        self.next = (self.next + i + 1) % len(self.credentials)
+                        return credential
+                    # No response told when the window ends (e.g. a proxy strips the headers), the default one is assumed
+                    if not credential.reset and not credential.in_flight:
+                        credential.reset = now + DEFAULT_WINDOW
+                # Credentials still waiting for responses have no reset yet, a release wakes this up
+                wait = min(c.reset or now for c in active) - now
+                log.info("rate limit quota used on every credential: waiting %.0f secs", wait)
+                self.condition.wait(timeout=max(wait, 1))
+
+    def release(self, credential, response=None):
+        with self.condition:
+            credential.in_flight -= 1
+            if response is not None:
+                self.requests += 1
+                headers = response.headers
+                if 'x-rate-limit-remaining' in headers and 'x-rate-limit-reset' in headers:
+                    # Other requests of this credential are still on their way, they will count against the quota too
+                    remaining = max(int(headers['x-rate-limit-remaining']) - credential.in_flight, 0)
+                    reset = int(headers['x-rate-limit-reset']) + RESET_MARGIN
+                    credential.limit = int(headers.get('x-rate-limit-limit', credential.limit))
+                    # Responses come back out of order, an older one of the same window cannot give quota back
+                    if reset == credential.reset:
+                        credential.remaining = min(credential.remaining, remaining)
+                    elif reset > credential.reset:
+                        credential.remaining = remaining
+                        credential.reset = reset
+                if response.status_code == 429:
+                    self.throttled += 1
+                    credential.remaining = 0
+                    credential.reset = credential.reset or time.time() + DEFAULT_WINDOW
+                if response.status_code in (401, 403):
+                    log.warning("credential rejected with %s, removed from rotation", response.status_code)
+                    credential.disabled = True
+            self.condition.notify_all()
+
+    def failure(self):
+        with self.condition:
+            self.errors += 1
+
+class ConcurrentHydrator():
+    """Drop-in for Hydrator.hydrate: lookups of 100 ids are sent concurrently over several credentials."""
+
+    def __init__(self, tokens, workers=8, url=LOOKUP_URL, max_errors=30, timeout=30):
+        self.scheduler = TokenScheduler(tokens)
+        self.workers = workers
+        self.url = url
+        self.max_errors = max_errors
+        self.timeout = timeout
+        self.sessions = local()
+
+    def session(self):
+        # requests sessions are not shared between threads
+        if not hasattr(self.sessions, 'session'):
+            self.sessions.session = requests.Session()
+        return self.sessions.session
+
+    def hydrate(self, ids):
+        ids = (str(id) for id in ids)
+        batches = iter(lambda: list(islice(ids, BATCH_SIZE)), [])
+        pending = set()
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            try:
+                while True:
+                    # At most two lookups per worker are queued, ids and responses of later batches are not held meanwhile
+                    for batch in islice(batches, self.workers * 2 - len(pending)):
+                        pending.add(pool.submit(self.lookup, batch))
+                    if not pending:
+                        return
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield from future.result()
+            finally:
+                # A consumer that stops early or a failed lookup does not wait for the queued ones
+                for future in pending:
+                    future.cancel()
+
+    def lookup(self, batch):
+        errors = 0
+        while True:
+            credential = self.scheduler.acquire()
+            response = None
+            try:
+                response = self.session().post(self.url, data={'id': ','.join(batch), 'tweet_mode': 'extended'}, headers={'Authorization': f"Bearer {credential.token}"}, timeout=self.timeout)
+                if response.status_code == 200:
+                    return response.json()
+            # Connection resets, timeouts and corrupted gzip bodies are retried like server errors
+            except (ConnectionError, ChunkedEncodingError, ContentDecodingError, ReadTimeout, ValueError) as e:
+                log.warning("caught %s: %s", type(e).__name__, e)
+            finally:
+                self.scheduler.release(credential, response)
+            # Another credential (or this one in its next window) takes the batch
+            if response is not None and response.status_code in (401, 403, 429):
+                continue
+            if response is not None and response.status_code < 500 and response.status_code != 200:
+                response.raise_for_status()
+            errors += 1
+            self.scheduler.failure()
+            if errors > self.max_errors:
+                raise RuntimeError(f"Too many errors from the Twitter API, giving up on {len(batch)} ids")
+            # Exponential backoff with jitter so concurrent lookups do not retry in lockstep
+            seconds = min(2 ** errors, 60) * random.uniform(0.5, 1)
+            log.warning("%s from Twitter API, sleeping %.1f secs", response.status_code if response is not None else 'error', seconds)
+            time.sleep(seconds)
@@ -1,66 +1,69 @@
-from dateutil.parser import parse
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.schema import Table
-from tqdm import tqdm
-import json
 import numpy as np
 import pandas as pd
-import re
 
 from .baseHandler import BaseHandler
-from ..lib import readDirectory, readFile
+from ..lib import readDirectory, readDirectoryParallel, readFile
 
 class FileToDatabaseHandler(BaseHandler):
+    supports_bulk = True
 
-    def __init__(self, meta, table, file=None, dir=None, id_field=None):
+    def __init__(self, meta, table, file=None, dir=None, id_field=None, update_columns=None):
         self.meta = meta
+        self.update_columns = update_columns
         self.source_file = file
         self.dir = dir
         self.id_field = id_field
         self.existing_ids = list()
         self.table = getTable(table, meta['target_engine'])
+        self.Mapper = self.table
 
     def build(self, **kwargs):
         return self.table(**kwargs)
 
+    def format_data(self, df):
+        # Chunks of parallel directory reads were formatted by the worker processes
+        if df.attrs.get('formatted'):
+            return df
+        return super().format_data(df)
+
     def getTableName(self):
         return self.table.__table__.name
 
+    def getCheckpointKey(self):
+        return f"{self.getTableName()}/{self.source_file or self.dir}"
+
     def getData(self):
+        position = self.getCheckpoint()
         if self.id_field:
             self.loadIds()
         if self.source_file:
-            yield from readFile(self.source_file, self.meta, self.id_field, self.existing_ids)
-        if self.dir:
-            yield from readDirectory(self.dir, self.meta, self.id_field, self.existing_ids)
+            start_row = position['row'] if position else 0
+            yield from self.track(readFile(self.source_file, self.meta, self.id_field, self.existing_ids, start_row=start_row, chunksize=self.getChunkSize, columns=self.getColumns()))
+        if self.dir and self.meta.get('file_workers', 0) > 1:
+            chunks = readDirectoryParallel(self.dir, self.meta, self.meta['file_workers'], self.getPlan(), self.id_field, self.existing_ids, position=position, chunksize=self.getChunkSize, timings=self.meta['metrics'].files[self.getTableName()], columns=self.getColumns())
+            yield from self.track(chunks)
+        elif self.dir:
+            yield from self.track(readDirectory(self.dir, self.meta, self.id_field, self.existing_ids, position=position, chunksize=self.getChunkSize, columns=self.getColumns()))
         del self.existing_ids
         return
 
-    def format_data(self, df):
-        if df.shape[0] == 0:
-            return df
-        #Detect date and json columns
-        for col in df.select_dtypes(include=['object']):
-            sample_val = df[col].loc[~df[col].isnull()].iloc[0]
-            try:
-                # Check if string is int or float
-                if re.match("^[0-9. ]+$", sample_val):
-                    pass
-                elif is_date(sample_val):
-                    df[col] = pd.to_datetime(df[col])
-                elif is_json(sample_val):
-                    df[col] = df.apply(lambda row : json.loads(row[col]), axis=1)
-            except (ValueError, TypeError):
-                pass
-        return super().format_data(df)
+    def getColumns(self):
+        # Columnar files (parquet, feather) only decode the columns of the target table
+        return [c.name for c in self.table.__table__.columns]
+
+    def track(self, chunks):
+        for df in chunks:
+            yield df
+            # Ids of rows just sent are added so later chunks and files skip them
+            if self.id_field and self.meta.get('dedup_files', False):
+                self.existing_ids.add(df[self.id_field])
 
     def loadIds(self):
         print(f"Querying existing {self.id_field}...")
         pk = getattr(self.table, self.id_field)
-        self.existing_ids = list()
-        for ids in tqdm(self.meta['target_session'].query(pk).yield_per(1000)):
-            self.existing_ids.append(ids)
-        self.existing_ids = {id[0] for id in self.existing_ids}
+        self.existing_ids = self.newIdIndex().load(self.get_read_session(), pk)
 
 def constructor(self, **kwargs):
     self.__dict__.update(kwargs)
@@ -71,17 +74,3 @@ def getTable(table, target_engine):
         "__init__": constructor,
         "__table__": Table(table, Base.metadata, autoload=True, autoload_with=target_engine),
     })
-
-def is_date(string):
-    try: 
-        parse(str(string))
-        return True
-    except (ValueError, TypeError):
-        return False
-
-def is_json(string):
-    try: 
-        json.loads(str(string))
-        return True
-    except ValueError:
-        return False
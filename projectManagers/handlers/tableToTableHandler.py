@@ -1,17 +1,30 @@
+from sqlalchemy import and_, cast, func, select, Integer, MetaData, String
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.schema import Table
 from tqdm import tqdm
 import numpy as np
 import pandas as pd
 
+# Number of primary key ranges a table is first split into in differential mode
+RANGES = 64
+
 from .baseHandler import BaseHandler
+from ..lib import filterExisting, readKeyset, readSQL
 class TableToTableHandler(BaseHandler):
+    supports_bulk = True
 
-    def __init__(self, meta, table, query_pk=False):
+    def __init__(self, meta, table, query_pk=False, update_columns=None):
         self.meta = meta
+        self.update_columns = update_columns
         self.existing_ids = list()
         self.query_pk = query_pk
         self.table = getTable(table, meta['target_engine'])
+        self.Mapper = self.table
+        # Keyset pagination needs a primary key to order and resume on
+        self.keyset = meta.get('keyset', False) and len(self.table.__table__.primary_key.columns) > 0
+        # Differential sync splits the table on a single integer primary key
+        pks = self.table.__table__.primary_key.columns.values()
+        self.differential = meta.get('differential', False) and len(pks) == 1 and isinstance(pks[0].type, Integer)
 
     def build(self, **kwargs):
         return self.table(**kwargs)
@@ -20,24 +33,83 @@ class TableToTableHandler(BaseHandler):
         return self.table.__table__.name
 
     def getData(self):
+        if self.differential:
+            yield from self.getDifferentialData()
+            return
         if self.query_pk:
             self.loadIds()
         print(f'Starting table {self.getTableName()}.')
-        chunks = pd.read_sql(self.getTableName(), con=self.meta['source_engine'], chunksize=self.meta['chunksize'])
+        if self.keyset:
+            position = self.getCheckpoint()
+            last = position['last_pk'] if position else None
+            chunks = readKeyset(self.getSourceTable(), self.meta['source_engine'], self.getChunkSize, last)
+        else:
+            chunks = readSQL(self.getTableName(), self.meta, self.getChunkSize())
         for df in tqdm(chunks):
-            yield df[~df[self.id_field].isin(self.existing_ids)].copy() if self.query_pk else df
+            if self.query_pk:
+                position = df.attrs.get('checkpoint')
+                df = filterExisting(df, self.id_field, self.existing_ids)
+                df.attrs['checkpoint'] = position
+            yield df
         del self.existing_ids
         print(f'Finished processing {self.getTableName()}.')
         return
 
+    def getDifferentialData(self):
+        table = self.table.__table__
+        pk = table.primary_key.columns.values()[0]
+        low, high = pd.read_sql(select(func.min(pk), func.max(pk)), con=self.meta['source_engine']).iloc[0]
+        if pd.isnull(low):
+            print(f'No data found in {self.getTableName()}.')
+            return
+        print(f'Comparing {self.getTableName()} by {pk.name} ranges.')
+        self.ranges_compared = 0
+        self.ranges_changed = 0
+        self.rows_fetched = 0
+        low, high = int(low), int(high) + 1
+        step = -(-(high - low) // RANGES)
+        for start in tqdm(range(low, high, step)):
+            yield from self.compareRange(table, pk, start, min(start + step, high))
+        print(f'{self.getTableName()}: {self.ranges_changed} of {self.ranges_compared} ranges differed, fetched {self.rows_fetched} rows.')
+
+    def compareRange(self, table, pk, low, high):
+        self.ranges_compared += 1
+        source = rangeChecksum(self.meta['source_engine'], table, pk, low, high)
+        target = rangeChecksum(self.meta['target_engine'], table, pk, low, high)
+        if source == target:
+            return
+        self.ranges_changed += 1
+        # Rows that only exist in the target are not deleted, upserts can only add or overwrite
+        if source[0] == 0:
+            return
+        # Narrow the range down until it is small enough to be fetched as a chunk
+        if source[0] > self.meta['chunksize'] and high - low > 1:
+            middle = (low + high) // 2
+            yield from self.compareRange(table, pk, low, middle)
+            yield from self.compareRange(table, pk, middle, high)
+            return
+        df = pd.read_sql(select(table).where(and_(pk >= low, pk < high)), con=self.meta['source_engine'])
+        self.rows_fetched += df.shape[0]
+        yield df
+
+    def getSourceTable(self):
+        # The query runs on the source, its columns and key types may differ from the target's
+        return Table(self.getTableName(), MetaData(), autoload_with=self.meta['source_engine'])
+
     def loadIds(self):
         pk = self.table.__mapper__.primary_key[0]
         self.id_field = pk.name
         print(f"Querying existing {self.id_field}...")
-        self.existing_ids = list()
-        for ids in tqdm(self.meta['target_session'].query(pk).yield_per(1000)):
-            self.existing_ids.append(ids)
-        self.existing_ids = {id[0] for id in self.existing_ids}
+        self.existing_ids = self.newIdIndex().load(self.get_read_session(), pk)
+
+def rangeChecksum(engine, table, pk, low, high):
+    """Row count and BIT_XOR of per-row CRC32s over a primary key range, computed by the server (MySQL)."""
+    # NULLs are replaced by a marker so that NULL and '' hash differently
+    values = [func.coalesce(cast(column, String), '\\N') for column in table.columns]
+    query = select(func.count(), func.coalesce(func.bit_xor(func.crc32(func.concat_ws('#', *values))), 0)).where(and_(pk >= low, pk < high))
+    with engine.connect() as connection:
+        count, checksum = connection.execute(query).first()
+    return int(count), int(checksum)
 
 def constructor(self, **kwargs):
     self.__dict__.update(kwargs)
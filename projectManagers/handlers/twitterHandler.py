@@ -1,6 +1,9 @@
+import numpy as np
 import pandas as pd
 import json
+from collections import deque, OrderedDict
 from os.path import join
+import os
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from sqlalchemy import Column, String, Integer, Boolean, DateTime, JSON, Float, ForeignKey
@@ -9,10 +12,49 @@ Base = declarative_base()
 
 OUTPUT_IDS = True
 
+TWITTER_DATE_FORMAT = "%a %b %d %H:%M:%S %z %Y"
+MONTHS = {month: f"{i:02d}" for i, month in enumerate(('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'), 1)}
+# Posts and users columns, and the v1 tweet/user fields they are read from
+POST_FIELDS = {
+    'id': 'id_str',
+    'created_at': 'created_at',
+    'truncated': 'truncated',
+    'text': 'full_text',
+    'lang': 'lang',
+    'retweet_count': 'retweet_count',
+    'favorite_count': 'favorite_count',
+    'is_quote_status': 'is_quote_status',
+    'in_reply_to_status_id_str': 'in_reply_to_status_id_str',
+    'in_reply_to_user_id_str': 'in_reply_to_user_id_str',
+    'in_reply_to_screen_name': 'in_reply_to_screen_name',
+    'entities': 'entities',
+    'coordinates': 'coordinates',
+    'place': 'place',
+}
+USER_FIELDS = {
+    'id': 'id_str',
+    'created_at': 'created_at',
+    'name': 'name',
+    'screen_name': 'screen_name',
+    'location': 'location',
+    'url': 'url',
+    'description': 'description',
+    'verified': 'verified',
+    'followers_count': 'followers_count',
+    'friends_count': 'friends_count',
+    'listed_count': 'listed_count',
+    'favourites_count': 'favourites_count',
+    'statuses_count': 'statuses_count',
+    'geo_enabled': 'geo_enabled',
+}
+
 from .baseHandler import BaseHandler
+from .concurrentHydrator import ConcurrentHydrator
 from .twitterUtils import Hydrator
 from .twitterUtils2 import Hydrator2
+from ..idIndex import IdIndex, validKeys
 from ..lib import getFiles, readDirectory, readFile, timer
+from ..tweetCache import MISSING_TTL, TweetCache
 
 class TwitterHandler(BaseHandler):
     pass
@@ -64,9 +106,23 @@ class PostsHandler(TwitterHandler):
     def __init__(self, meta, dataset_id):
         super().__init__(meta)
         self.__tablename__ = self.Posts.__tablename__
+        self.Mapper = self.Posts
         self.dataset_id = dataset_id
         self.usersHandler = UsersHandler(meta)
-        self.hydrator = Hydrator()
+        # Users and new tweet ids of each hydrated chunk, in order. With prefetching the reader runs ahead of the writer.
+        self.users = deque()
+        # With several app credentials, lookups are sent concurrently and paced by each credential's rate limit
+        tokens = (meta.get('dbs') or {}).get('twitter_tokens')
+        self.hydrator = ConcurrentHydrator(tokens, workers=meta.get('hydration_workers', 8)) if tokens else Hydrator()
+        # Raw tweets hydrated by previous runs, only ids missing from it are sent to the API
+        self.cache = TweetCache(meta['tweet_cache'], meta.get('missing_ttl', MISSING_TTL)) if meta.get('tweet_cache') else None
+        # Tweet ids stored for this dataset or written by this run, across every seed file
+        self.seen_ids = None
+        # Tweet ids hydrated but not written yet, later chunks do not hydrate them again
+        self.pending_ids = set()
+
+    def getCheckpointKey(self):
+        return f"{self.getTableName()}/{self.dataset_id}"
 
     def getData(self):
         directory = self.meta['dir']
@@ -79,71 +135,119 @@ class PostsHandler(TwitterHandler):
             with open("tweet_ids.json", "w") as outfile:
                 outfile.write(json_object)
             return
-        start_chunk = 0
+        position = self.getCheckpoint()
+        self.loadSeenIds()
         for file in files:
+            path = join(directory, file)
+            # Resuming from a checkpoint skips the files that were already processed
+            if position and path < position['file']:
+                continue
+            start_row = position['row'] if position and path == position['file'] else 0
             self.total_read = 0
             self.total_unique_ids  = 0
             self.total_fetched = 0
             self.total_duplicates = 0
-            path = join(directory, file)
-            for df in readFile(path, settings=self.meta, start_chunk=start_chunk):
+            self.total_seen = 0
+            for df in readFile(path, settings=self.meta, start_row=start_row):
                 tweet_ids = df.iloc[:, 0].tolist()
-                yield self.process(tweet_ids, df)
-            start_chunk = 0
-            print(f"Read a total of {self.total_read} seeds, queried {self.total_unique_ids} unique ids.")
+                tweets_df = self.process(tweet_ids, df)
+                tweets_df.attrs['checkpoint'] = df.attrs['checkpoint']
+                yield tweets_df
+            print(f"Read a total of {self.total_read} seeds, queried {self.total_unique_ids - self.total_seen} unique ids ({self.total_seen} already seen).")
             print(f"Fetched {self.total_fetched} tweet objects back and found {self.total_duplicates} duplicates (removed).")
             print(f"{self.total_fetched - self.total_duplicates} total tweets")
+            if self.cache:
+                print(self.cache.report())
+            print(self.usersHandler.report())
 
     # This function will merge tweet request results and data from source files
     def append_func(self, tweets_df, file_df):
         file_df.columns = ['id', 'text_sentiment']
+        # Tweet ids are kept as strings, seed files hold them as numbers
+        file_df['id'] = file_df['id'].astype(str)
         return tweets_df.merge(file_df, left_on='id', right_on='id', how='left')
 
     def process(self, tweet_ids, file_df=None):
-        unique_ids = set(tweet_ids)
-        tweets_generator = self.hydrator.hydrate(unique_ids)
-        tweets_df = pd.DataFrame(tweets_generator)
+        seeds = pd.Series(tweet_ids, dtype=object)
+        # Blank lines and empty cells are not ids
+        unique_ids = list(set(seeds[seeds.notna() & (seeds.astype(str).str.strip() != '')]))
+        ids, valid = validKeys(unique_ids, numeric=True)
+        # Stray headers or ids that lost digits in a float ("1.2e+18") cannot be looked up, the rest of the chunk is
+        if not valid.all():
+            invalid = [seed for seed, ok in zip(unique_ids, valid) if not ok]
+            print(f"Skipped {len(invalid)} seeds that are not tweet ids, e.g. {invalid[:3]}")
+        # "123" and 123 are the same tweet
+        ids = np.unique(ids[valid])
+        new_ids = ids[~self.seen_ids.isin(ids) & ~np.isin(ids, list(self.pending_ids))]
+        self.pending_ids.update(new_ids.tolist())
+        self.total_read += len(tweet_ids)
+        self.total_unique_ids += len(ids)
+        self.total_seen += len(ids) - len(new_ids)
+        tweets_generator = self.hydrate(new_ids.tolist())
+        tweets_df, users_df = flattenTweets(tweets_generator, self.dataset_id)
+        self.users.append((users_df, new_ids))
         if tweets_df.shape[0] == 0:
             return tweets_df
         tweets_received = tweets_df.shape[0]
-        # Add dataset key
-        tweets_df['source_id'] = self.dataset_id
         # If source file data needs to be appended to the result
         if file_df is not None:
             tweets_df = self.append_func(tweets_df, file_df)
         # Filtering duplicates as there are cases of duplicate tweets after appending file data
         tweets_df.drop_duplicates(subset='id', inplace=True)
-        self.total_read += len(tweet_ids)
-        self.total_unique_ids += len(unique_ids)
         self.total_fetched += tweets_received
         self.total_duplicates += tweets_received - tweets_df.shape[0]
-        # Extracting users
-        self.users_df = pd.DataFrame(tweets_df['user'].tolist())
         return tweets_df
 
-    def format_data(self, df):
-        # Drop integer 'id' column and replace with str version
-        df = df.drop(columns=["id"])
-        df = df.rename(columns={"id_str": "id", "full_text": "text"})
-        df['created_at'] = pd.to_datetime(df.created_at, format="%a %b %d %H:%M:%S %z %Y")
-        # Initialize nullable fields
-        df['quoted_status_id_str'] = None
-        df['possibly_sensitive'] = None
-        # Extract retweet id
-        df['retweet_id_str'] = df.apply(lambda row : row['retweeted_status']['id_str'] if 'retweeted_status' in row and isinstance(row['retweeted_status'], dict) else None, axis=1)
-        # df['retweet_id_str'] = df.apply(lambda row : row['retweeted_status']['id_str'] if 'retweeted_status' in row else None, axis=1)
-        df['user'] = df.apply(lambda row : row['user']['id_str'], axis=1)
-        return super().format_data(df)
-
-    def execute(self, session, items):
+    def getSeenIdsPath(self):
+        return join(self.meta['seen_ids'], f"{self.getTableName()}_{self.dataset_id}.npy") if self.meta.get('seen_ids') else None
+
+    def loadSeenIds(self):
+        path = self.getSeenIdsPath()
+        # A saved index replaces the query on the posts table
+        if path and os.path.isfile(path):
+            self.seen_ids = IdIndex(numeric=True).loadFile(path)
+        else:
+            self.seen_ids = IdIndex(numeric=True).load(self.get_read_session(), self.Posts.id, self.Posts.source_id == self.dataset_id)
+
+    def postOperations(self, session=None):
+        # Saved once every chunk is written, ids of an interrupted run are never marked as stored
+        path = self.getSeenIdsPath()
+        if path and self.seen_ids is not None and self.meta['commit']:
+            os.makedirs(self.meta['seen_ids'], exist_ok=True)
+            self.seen_ids.save(path)
+        self.usersHandler.postOperations(session)
+
+    def hydrate(self, ids):
+        if self.cache is None:
+            return self.hydrator.hydrate(ids)
+        tweets, missing = self.cache.get(ids)
+        if missing:
+            fetched = list(self.hydrator.hydrate(missing))
+            self.cache.put(fetched, missing)
+            tweets += fetched
+        return tweets
+
+    def execute(self, session, items, dict_items):
+        users_df, new_ids = self.users.popleft()
         # First insert users
-        self.users_df = self.usersHandler.format_data(self.users_df)
-        users = [self.usersHandler.build(**kwargs) for kwargs in self.users_df.to_dict(orient='records')]
-        self.usersHandler.execute(session, users)
+        users_df, hashes = self.usersHandler.changed(users_df)
+        if users_df.shape[0] > 0:
+            ids = users_df['id'].tolist()
+            users_df = self.usersHandler.format_data(users_df)
+            users_dicts = users_df.to_dict(orient='records')
+            users = [self.usersHandler.build(**kwargs) for kwargs in users_dicts]
+            # Profiles of users that were not written are written again with the next chunk holding them
+            if not self.usersHandler.execute(session, users, users_dicts)['failed']:
+                self.usersHandler.remember(ids, hashes)
         # Attempting without ID pre-loading, merging duplicates instead
         # items = [item for item in items if item.id not in self.existing_ids]
         # Insert tweets
-        super().execute(session, items)
+        stats = super().execute(session, items, dict_items)
+        # Only ids of written chunks are seen, a failed chunk is hydrated again by the next run
+        if not stats['failed']:
+            self.seen_ids.add(new_ids)
+        self.pending_ids.difference_update(new_ids.tolist())
+        return stats
         # session.add_all(items)
         # if self.meta['commit']:
         #     session.commit()
@@ -180,6 +284,15 @@ class UsersHandler(TwitterHandler):
     def __init__(self, meta):
         super().__init__(meta)
         self.__tablename__ = self.Users.__tablename__
+        self.Mapper = self.Users
+        # Hash of the profile last written for recently seen users (LRU). Authors of many tweets are only rewritten when their profile changed.
+        self.profiles = OrderedDict()
+        self.profiles_size = meta.get('user_cache_size', 1000000)
+        self.lookups = 0
+        self.unchanged = 0
+        if meta.get('user_hashes') and os.path.isfile(meta['user_hashes']):
+            saved = np.load(meta['user_hashes'])
+            self.profiles.update(zip(saved['ids'].tolist(), saved['hashes'].tolist()))
         # Attempting without ID pre-loading, merging duplicates instead
         # self.existing_ids = list(meta['session'].query(self.Users.id))
         # self.existing_ids = {id[0] for id in self.existing_ids}
@@ -187,17 +300,41 @@ class UsersHandler(TwitterHandler):
     def build(self, **kwargs):
         return self.Users(**kwargs)
 
-    def format_data(self, df):
-        df.drop_duplicates("id", inplace=True)
-        df = df.drop(columns=["id"])
-        df = df.rename(columns={"id_str": "id"})
-        df['created_at'] = pd.to_datetime(df.created_at, format="%a %b %d %H:%M:%S %z %Y")
-        return super().format_data(df)
+    def changed(self, df):
+        """Users whose profile differs from the one last written, and the hashes of their profiles."""
+        if df.shape[0] == 0:
+            return df, []
+        hashes = pd.util.hash_pandas_object(df[list(USER_FIELDS)], index=False).tolist()
+        keep = np.ones(df.shape[0], dtype=bool)
+        for i, (id, profile) in enumerate(zip(df['id'].tolist(), hashes)):
+            if self.profiles.get(int(id)) == profile:
+                keep[i] = False
+                self.profiles.move_to_end(int(id))
+        self.lookups += df.shape[0]
+        self.unchanged += int((~keep).sum())
+        return df[keep], [profile for profile, kept in zip(hashes, keep) if kept]
+
+    def remember(self, ids, hashes):
+        for id, profile in zip(ids, hashes):
+            self.profiles[int(id)] = profile
+            self.profiles.move_to_end(int(id))
+        while len(self.profiles) > self.profiles_size:
+            self.profiles.popitem(last=False)
+
+    def report(self):
+        ratio = self.unchanged / self.lookups if self.lookups else 0
+        return f"User profiles: {ratio:.1%} unchanged, {self.unchanged} of {self.lookups} user rows not written."
 
-    def execute(self, session, items):
+    def postOperations(self, session=None):
+        # Hashes are only carried to the next run once every chunk is committed
+        if self.meta.get('user_hashes') and self.meta['commit']:
+            np.savez(f"{self.meta['user_hashes']}.tmp.npz", ids=np.fromiter(self.profiles.keys(), dtype=np.uint64, count=len(self.profiles)), hashes=np.fromiter(self.profiles.values(), dtype=np.uint64, count=len(self.profiles)))
+            os.replace(f"{self.meta['user_hashes']}.tmp.npz", self.meta['user_hashes'])
+
+    def execute(self, session, items, dict_items):
         # Attempting without ID pre-loading, merging duplicates instead
         # Remove this method if successful
-        super().execute(session, items)
+        return super().execute(session, items, dict_items)
 
         # items = [item for item in items if item.id not in self.existing_ids]
         # session.bulk_save_objects(items)
@@ -205,3 +342,33 @@ class UsersHandler(TwitterHandler):
         # self.existing_ids |= {item.id for item in items}
         # if self.meta['commit']:
         #     session.commit()
+
+def flattenTweets(tweets, dataset_id):
+    """Posts and users frames of a hydrated batch, reading only the stored fields of each tweet once."""
+    tweets = list(tweets)
+    users = [tweet.get('user') or {} for tweet in tweets]
+    posts_df = pd.DataFrame({column: [tweet.get(field) for tweet in tweets] for column, field in POST_FIELDS.items()}, columns=list(POST_FIELDS))
+    posts_df['user'] = [user.get('id_str') for user in users]
+    posts_df['retweet_id_str'] = [tweet['retweeted_status'].get('id_str') if isinstance(tweet.get('retweeted_status'), dict) else None for tweet in tweets]
+    # Initialize nullable fields
+    posts_df['quoted_status_id_str'] = None
+    posts_df['possibly_sensitive'] = None
+    # Add dataset key
+    posts_df['source_id'] = dataset_id
+    posts_df['created_at'] = parseDates(posts_df['created_at'])
+    users_df = pd.DataFrame({column: [user.get(field) for user in users] for column, field in USER_FIELDS.items()}, columns=list(USER_FIELDS))
+    users_df = users_df[users_df['id'].notna()].drop_duplicates('id')
+    users_df['created_at'] = parseDates(users_df['created_at'])
+    return posts_df, users_df
+
+def parseDates(series):
+    """UTC datetimes of Twitter dates ('Wed Oct 10 20:19:24 +0000 2018')."""
+    values = series.tolist()
+    # Twitter always answers in UTC: the fields are rearranged into a numeric format pandas parses without strptime
+    try:
+        if all(value[20:25] == '+0000' for value in values):
+            dates = pd.to_datetime([f"{value[26:30]}-{MONTHS[value[4:7]]}-{value[8:10]} {value[11:19]}" for value in values], format='%Y-%m-%d %H:%M:%S')
+            return pd.Series(dates.tz_localize('UTC'), index=series.index)
+    except (TypeError, KeyError, ValueError):
+        pass
+    return pd.to_datetime(series, format=TWITTER_DATE_FORMAT, errors='coerce', utc=True)
@@ -19,9 +19,10 @@ warnings.filterwarnings(
 
 Base = declarative_base()
 
-from ..lib import updateProgress
+from ..lib import filterExisting, keysetPredicate, readSQL, toPython, updateProgress
 from .baseHandler import BaseHandler
 class YoutubeHandler(BaseHandler):
+    supports_bulk = True
 
     def __init__(self, meta):
         self.meta = meta
@@ -30,9 +31,12 @@ class YoutubeHandler(BaseHandler):
     def build(self, **kwargs):
         return self.Mapper(**kwargs)
 
+    def getCheckpointKey(self):
+        return f"{self.meta['tracker_id']}/{self.getTableName()}"
+
     def getData(self):
+        position = self.getCheckpoint()
         table = self.Mapper
-        source_engine = self.meta['source_engine']
         source_session = self.meta['source_session']
         target_date_field = 'modified_to_db_time'
         update_field = getattr(table, target_date_field)
@@ -51,6 +55,10 @@ class YoutubeHandler(BaseHandler):
             latest_entry = source_session.query(table).order_by(update_field.asc()).first()
             last_date = getattr(latest_entry, target_date_field).replace(second=0, hour=0, minute=0)
             print(f'No last_date found in the tracker. Updating since the beginning of collection ({last_date})')
+        # Resume within the day the previous run stopped at
+        if position is not None:
+            last_date = pd.Timestamp(position['day'])
+            print(f'Resuming from {last_date}, after {position.get("last_pk", position.get("row"))}')
         if target_date < last_date:
             print('Table is up to date.')
             return
@@ -61,19 +69,31 @@ class YoutubeHandler(BaseHandler):
             updateProgress(days_progression, current_day, target_date, day_total, total)
             low_bound_date = current_day.strftime('%Y-%m-%d')
             high_bound_date = (current_day + timedelta(days=1)).strftime('%Y-%m-%d')
-            query = source_session.query(table).filter(and_(update_field >= low_bound_date, update_field < high_bound_date))
-            day_total = 0
-            chunks = pd.read_sql(query.statement, con=source_engine, chunksize=self.meta['chunksize'])
             pks = [pk for pk in inspect(table).primary_key]
+            # Ordered by primary key, the resumed day starts after the last committed key
+            query = source_session.query(table).filter(and_(update_field >= low_bound_date, update_field < high_bound_date)).order_by(*pks)
+            day_total = 0
+            resumed = position if position is not None and current_day == last_date else None
+            # Unlike an offset, the key does not shift when rows of the day are modified between runs
+            if resumed and 'last_pk' in resumed:
+                query = query.filter(keysetPredicate(pks, resumed['last_pk']))
+            # Checkpoints written before keys were recorded hold a row offset
+            elif resumed and resumed.get('row'):
+                query = query.offset(resumed['row'])
+            chunksize = self.getChunkSize()
+            # Counted on the source session before the day is streamed on a connection of its own
             count_query = source_session.query(*pks).filter(and_(update_field >= low_bound_date, update_field < high_bound_date))
+            chunks = readSQL(query.statement, self.meta, chunksize)
             try:
                 day_count = count_query.count()
-                chunks_progression = tqdm(chunks, leave=False, total=(day_count // self.meta['chunksize']), desc=f'Packets (total {humanize.intcomma(day_count)})')
+                chunks_progression = tqdm(chunks, leave=False, total=(day_count // chunksize), desc=f'Packets (total {humanize.intcomma(day_count)})')
             except OperationalError:
                 chunks_progression = tqdm(chunks, leave=False, desc=f'Packets (too large to show total)')
             for df in chunks_progression:
                 day_total += df.shape[0]
                 total += df.shape[0]
+                if df.shape[0]:
+                    df.attrs['checkpoint'] = {'day': current_day.isoformat(), 'last_pk': [toPython(df[pk.name].iloc[-1]) for pk in pks]}
                 yield df
             updateProgress(days_progression, current_day, target_date, day_total, total)
 
@@ -100,19 +120,18 @@ class TrackerRelationShipHandler(YoutubeHandler):
 
     def getData(self):
         def getRelationShips(content_type, id_field, table=None, file=None):
-            content_in_tracker = self.meta['target_session'].query(self.TrackerRelationship.content_id).filter(and_(self.TrackerRelationship.tracker == self.meta['tracker_id'], self.TrackerRelationship.content_type == content_type))
-            content_in_tracker = set([row.content_id for row in content_in_tracker])
+            content_in_tracker = self.newIdIndex(f"{self.meta['tracker_id']}_{content_type}").load(self.get_read_session(), self.TrackerRelationship.content_id, self.TrackerRelationship.tracker == self.meta['tracker_id'], self.TrackerRelationship.content_type == content_type)
             if file:
                 chunks = [pd.read_csv(file, usecols=[id_field], na_filter=False)]
             else:
-                chunks = pd.read_sql(table, con=self.meta['source_engine'], columns=[id_field], chunksize=self.meta['chunksize'])
+                chunks = readSQL(table, self.meta, self.getChunkSize(), columns=[id_field])
             total_rows_added = 0
             progression = tqdm(chunks)
             for df in progression:
                 df['tracker'] = self.meta['tracker_id']
                 df['content_type'] = content_type
                 df = df.rename(columns={id_field: 'content_id'})
-                df = df[~df['content_id'].isin(content_in_tracker)]
+                df = filterExisting(df, 'content_id', content_in_tracker)
                 total_rows_added += df.shape[0]
                 progression.set_description(desc=f'Tracker currently has {len(content_in_tracker)} {content_type}s. [Adding {df.shape[0]} rows / Total {total_rows_added}]', refresh=True)
                 yield df
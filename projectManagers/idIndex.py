@@ -0,0 +1,331 @@
+from datetime import datetime
+from math import ceil, log
+from sqlalchemy import select, and_, exists, func, Column, Integer, MetaData, String, Table
+from time import time
+import humanize
+import numpy as np
+import os
+import pandas as pd
+
+# Ids are fetched from the target in batches of this size
+FETCH_SIZE = 100000
+# Ids confirmed against the target per IN (...) query
+LOOKUP_SIZE = 1000
+# Larger integers cannot be told apart once read as floats
+MAX_FLOAT_ID = 2 ** 53
+# Bloom filter file header: magic, size, hashes, ids counted in the target when built, build time
+BLOOM_MAGIC = 0x626c6f6f6d7632
+# Hash key of the second, independent hash of the ids added by a run (pandas' default key is the first)
+CHECK_KEY = '6d7f1a0c9e3b2f48'
+
+def toKeys(values, numeric=False):
+    """Fixed-width uint64 keys. Numeric ids are kept as is, other ids are hashed from their string form
+    so that ids read from files and from the database match."""
+    if numeric:
+        return toIntegers(values).view(np.uint64)
+    return hashIds(values)
+
+def hashIds(values, hash_key=None):
+    values = pd.Series(values, dtype=object).astype(str).to_numpy(dtype=object)
+    return pd.util.hash_array(values) if hash_key is None else pd.util.hash_array(values, hash_key=hash_key)
+
+def validKeys(values, numeric=False):
+    """Keys and a mask of the values that can be ids. Values of an integer column that are not integers
+    (blank, text, fractional) get key 0 and are left out of the mask instead of raising."""
+    if numeric:
+        integers, valid = integerIds(values)
+        return integers.view(np.uint64), valid
+    return hashIds(values), np.ones(len(values), dtype=bool)
+
+def toIntegers(values):
+    """Integer ids as int64, whether they were read as ints, floats or text. Anything else raises ValueError."""
+    integers, valid = integerIds(values)
+    if not valid.all():
+        raise ValueError(f"{(~valid).sum()} ids are missing, not integers or too large to be exact as floats")
+    return integers
+
+def parseInteger(value):
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    try:
+        return int(str(value))
+    except ValueError:
+        return None
+
+def integerIds(values):
+    """Integer ids as int64 and a mask of the values that are integer ids, whether they were read as ints, floats or text."""
+    values = pd.Series(values, copy=False)
+    if values.dtype.kind in 'iu':
+        return values.to_numpy(dtype=np.int64), np.ones(len(values), dtype=bool)
+    if values.dtype.kind == 'f':
+        array = values.to_numpy()
+        valid = np.isfinite(array) & (array % 1 == 0) & (np.abs(array) < MAX_FLOAT_ID)
+        return np.where(valid, array, 0).astype(np.int64), valid
+    # Text is parsed exactly, "123" and 123 are the same id but "123.5" or "" are not ids
+    parsed = [parseInteger(value) for value in values]
+    valid = np.fromiter((value is not None and -2 ** 63 <= value < 2 ** 63 for value in parsed), dtype=bool, count=len(parsed))
+    return np.fromiter((value if ok else 0 for value, ok in zip(parsed, valid)), dtype=np.int64, count=len(parsed)), valid
+
+def isNumeric(column):
+    return isinstance(column.type, Integer)
+
+def confirm(session, column, conditions, candidates):
+    """The candidates actually present in the target, as strings."""
+    found = set()
+    for i in range(0, len(candidates), LOOKUP_SIZE):
+        query = select(column).where(and_(column.in_(candidates[i:i + LOOKUP_SIZE]), *conditions))
+        found.update(str(row[0]) for row in session.execute(query))
+    return found
+
+def fetchKeys(session, column, conditions=(), numeric=False):
+    query = select(column)
+    if conditions:
+        query = query.where(and_(*conditions))
+    # Streamed so the id column never has to fit in memory as Python objects
+    result = session.connection().execution_options(stream_results=True).execute(query)
+    while True:
+        rows = result.fetchmany(FETCH_SIZE)
+        if not rows:
+            return
+        yield toKeys([row[0] for row in rows], numeric)
+
+class IdIndex():
+    """Existing ids as a sorted uint64 array, membership is a vectorized binary search.
+
+    Integer ids are stored exactly. Other ids are hashed and can collide, a hit is confirmed against the
+    target (or a second hash of the ids added by this run) before a row is reported as existing.
+    Values of an integer column that are not integers are never existing, their rows are kept for the
+    target to accept or reject. 'numeric' None takes it from the type of the loaded column."""
+
+    def __init__(self, numeric=None):
+        self.numeric = numeric
+        self.keys = np.empty(0, dtype=np.uint64)
+        # Ids added since the last merge, kept apart so each chunk does not re-sort the whole index
+        self.pending = np.empty(0, dtype=np.uint64)
+        # Second hashes of the ids added by this run, they may not be in the target yet
+        self.checks = np.empty(0, dtype=np.uint64)
+        self.session = None
+        # Hashed ids read from a file cannot be confirmed, their hits are kept
+        self.unconfirmable = False
+
+    def __len__(self):
+        return len(self.keys) + len(self.pending)
+
+    @property
+    def nbytes(self):
+        return self.keys.nbytes + self.pending.nbytes + self.checks.nbytes
+
+    def load(self, session, column, *conditions):
+        start = time()
+        if self.numeric is None:
+            self.numeric = isNumeric(column)
+        self.session = session
+        self.column = column
+        self.conditions = conditions
+        parts = list(fetchKeys(session, column, conditions, self.numeric))
+        self.keys = np.unique(np.concatenate(parts)) if parts else np.empty(0, dtype=np.uint64)
+        self.pending = np.empty(0, dtype=np.uint64)
+        print(f"Loaded {humanize.intcomma(len(self))} {column.key} in {time() - start:.1f}s ({humanize.naturalsize(self.nbytes)})")
+        return self
+
+    def loadFile(self, path):
+        self.keys = np.load(path)
+        self.unconfirmable = not self.numeric
+        self.pending = np.empty(0, dtype=np.uint64)
+        print(f"Loaded {humanize.intcomma(len(self))} ids from {path} ({humanize.naturalsize(self.nbytes)})")
+        return self
+
+    def save(self, path):
+        # Written aside and renamed, an interrupted save keeps the previous file
+        np.save(f"{path}.tmp.npy", np.union1d(self.keys, self.pending))
+        os.replace(f"{path}.tmp.npy", path)
+
+    def add(self, values):
+        keys, valid = validKeys(values, self.numeric)
+        self.pending = np.union1d(self.pending, keys[valid])
+        if not self.numeric:
+            self.checks = np.union1d(self.checks, hashIds(values, CHECK_KEY))
+        if len(self.pending) > len(self.keys) // 8:
+            self.keys = np.union1d(self.keys, self.pending)
+            self.pending = np.empty(0, dtype=np.uint64)
+
+    def isin(self, values):
+        keys, valid = validKeys(values, self.numeric)
+        hits = valid & (contains(self.keys, keys) | contains(self.pending, keys))
+        if self.numeric or not hits.any():
+            return hits
+        # A hashed hit may be a collision with another id, an added id also matches on the second hash
+        values = pd.Series(values, dtype=object, copy=False).reset_index(drop=True).astype(str)
+        added = hits & contains(self.checks, hashIds(values, CHECK_KEY))
+        unconfirmed = hits & ~added
+        if not unconfirmed.any() or self.session is None:
+            # Without a target every other hit is a collision with an added id
+            return added | (unconfirmed & self.unconfirmable)
+        found = confirm(self.session, self.column, self.conditions, values[unconfirmed].unique().tolist())
+        return added | (unconfirmed & values.isin(found).to_numpy())
+
+def contains(sorted_keys, keys):
+    if len(sorted_keys) == 0:
+        return np.zeros(len(keys), dtype=bool)
+    positions = np.searchsorted(sorted_keys, keys)
+    positions[positions == len(sorted_keys)] = 0
+    return sorted_keys[positions] == keys
+
+class BloomIdIndex():
+    """Existing ids as an on-disk Bloom filter for tables too large for IdIndex.
+
+    A negative answer is definite. Ids the filter may contain are confirmed against the target table,
+    so only the maybe-present part of a chunk is ever queried. The file is reused by later runs and
+    kept up to date with the ids added through this index. It records how many ids the target held
+    and when it was built, it is rebuilt when the target's count changed (e.g. other writers inserted rows)."""
+
+    HEADER = 5
+
+    def __init__(self, path, error_rate=0.01, numeric=None):
+        self.path = path
+        self.error_rate = error_rate
+        self.numeric = numeric
+        self.bits = None
+        # Ids added by this run may not be committed yet, they are confirmed from memory instead
+        self.added = IdIndex(numeric)
+
+    def __len__(self):
+        return self.count + len(self.added)
+
+    @property
+    def nbytes(self):
+        return (self.bits.nbytes if self.bits is not None else 0) + self.added.nbytes
+
+    def open(self, capacity):
+        if os.path.isfile(self.path) and os.path.getsize(self.path) > self.HEADER * 8:
+            self.header = np.memmap(self.path, dtype=np.uint64, mode='r+', shape=(self.HEADER,))
+            magic, size, hashes, count, built = (int(value) for value in self.header)
+            # The filter only knows the ids of its build and of this index's runs
+            if magic == BLOOM_MAGIC and count == self.count:
+                self.size, self.hashes = size, hashes
+                self.bits = np.memmap(self.path, dtype=np.uint8, mode='r+', offset=self.HEADER * 8)
+                print(f"Reusing Bloom filter built {datetime.fromtimestamp(built):%Y-%m-%d %H:%M}")
+                return False
+            del self.header
+            print(f"Rebuilding stale Bloom filter {self.path}")
+            os.remove(self.path)
+        self.size = max(64, ceil(-capacity * log(self.error_rate) / log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * log(2)))
+        self.header = np.memmap(self.path, dtype=np.uint64, mode='w+', shape=(self.HEADER,))
+        self.header[:] = [BLOOM_MAGIC, self.size, self.hashes, self.count, int(time())]
+        self.header.flush()
+        self.bits = np.memmap(self.path, dtype=np.uint8, mode='r+', offset=self.HEADER * 8, shape=(ceil(self.size / 8),))
+        return True
+
+    def positions(self, keys):
+        # Integer ids are mixed first, their high bits are mostly zero and consecutive ids would probe consecutive bits
+        if self.numeric:
+            keys = pd.util.hash_array(keys)
+        # Double hashing: position i is h1 + i * h2
+        h1 = keys & np.uint64(0xffffffff)
+        h2 = (keys >> np.uint64(32)) | np.uint64(1)
+        return [(h1 + np.uint64(i) * h2) % np.uint64(self.size) for i in range(self.hashes)]
+
+    def load(self, session, column, *conditions):
+        start = time()
+        self.session = session
+        self.column = column
+        self.conditions = conditions
+        if self.numeric is None:
+            self.numeric = isNumeric(column)
+            self.added.numeric = self.numeric
+        self.count = session.query(func.count(column)).filter(*conditions).scalar()
+        # An existing filter is reused, only a new one has to scan the target
+        if self.open(max(self.count, 1) * 2):
+            for keys in fetchKeys(session, column, conditions, self.numeric):
+                self.addKeys(keys)
+            self.bits.flush()
+        print(f"Loaded Bloom filter of {humanize.intcomma(self.count)} {column.key} in {time() - start:.1f}s ({humanize.naturalsize(self.nbytes)} on disk)")
+        return self
+
+    def addKeys(self, keys):
+        for position in self.positions(keys):
+            np.bitwise_or.at(self.bits, (position >> np.uint64(3)).astype(np.int64), (np.uint8(1) << (position & np.uint64(7)).astype(np.uint8)))
+
+    def add(self, values):
+        new = ~self.added.isin(values)
+        keys, valid = validKeys(values, self.numeric)
+        self.addKeys(keys[valid])
+        self.bits.flush()
+        self.added.add(values)
+        # Counted like the target will once they are committed, a filter out of step is rebuilt next run
+        self.header[3] += np.uint64(pd.Series(values, copy=False)[new].nunique())
+        self.header.flush()
+
+    def isin(self, values):
+        values = pd.Series(values, copy=False).reset_index(drop=True)
+        keys, maybe = validKeys(values, self.numeric)
+        for position in self.positions(keys):
+            maybe &= (self.bits[(position >> np.uint64(3)).astype(np.int64)] >> (position & np.uint64(7)).astype(np.uint8)) & np.uint8(1) == 1
+        if not maybe.any():
+            return maybe
+        added = maybe & self.added.isin(values)
+        maybe &= ~added
+        found = confirm(self.session, self.column, self.conditions, values[maybe].unique().tolist())
+        # Compared as strings, ids read from files are not typed like the target column
+        return added | (maybe & values.astype(str).isin(found).to_numpy())
+
+class StagedIdIndex():
+    """Existing ids looked up on the target itself. Each chunk's ids are bulk-loaded into a temporary table
+    and the database returns the new ones (anti-join), so memory does not depend on the target's size.
+
+    Lookups run on a connection of their own, each in a short transaction so rows committed by the
+    writers are seen. Ids added by this run are staged in a second temporary table."""
+
+    def __len__(self):
+        return self.count + self.sent
+
+    @property
+    def nbytes(self):
+        return 0
+
+    def load(self, session, column, *conditions):
+        self.column = column
+        self.conditions = conditions
+        self.count = session.query(func.count(column)).filter(*conditions).scalar()
+        self.sent = 0
+        # MySQL needs a length for VARCHAR columns
+        type_ = String(255) if isinstance(column.type, String) and column.type.length is None else column.type
+        metadata = MetaData()
+        name = f"{column.table.name}_{column.key}"
+        self.staging = Table(f"staging_{name}", metadata, Column('id', type_), prefixes=['TEMPORARY'])
+        self.sent_ids = Table(f"sent_{name}", metadata, Column('id', type_, index=True), prefixes=['TEMPORARY'])
+        # Temporary tables only exist on the connection that created them
+        self.connection = session.get_bind().connect()
+        with self.connection.begin():
+            metadata.create_all(self.connection)
+        print(f"Staging {column.key} lookups on the target ({humanize.intcomma(self.count)} existing)")
+        return self
+
+    def __del__(self):
+        if hasattr(self, 'connection'):
+            self.connection.close()
+
+    def add(self, values):
+        ids = pd.Series(values, copy=False).dropna().astype(str).unique()
+        if len(ids) == 0:
+            return
+        with self.connection.begin():
+            self.connection.execute(self.sent_ids.insert(), [{'id': id} for id in ids])
+        self.sent += len(ids)
+
+    def isin(self, values):
+        values = pd.Series(values, copy=False).reset_index(drop=True).astype(str)
+        ids = values.unique()
+        if len(ids) == 0:
+            return np.zeros(len(values), dtype=bool)
+        staged = self.staging.c.id
+        query = select(staged).where(
+            ~exists().where(and_(self.column == staged, *self.conditions)),
+            ~exists().where(self.sent_ids.c.id == staged),
+        )
+        with self.connection.begin():
+            self.connection.execute(self.staging.delete())
+            self.connection.execute(self.staging.insert(), [{'id': id} for id in ids])
+            new_ids = {str(row[0]) for row in self.connection.execute(query)}
+        return ~values.isin(new_ids).to_numpy()
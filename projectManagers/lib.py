@@ -1,78 +1,619 @@
 import humanize
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, select, and_, or_, DateTime
 from os.path import isfile, join, splitext
 from os import listdir
+import csv
 import json
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from io import StringIO
+from itertools import chain, islice, repeat
 from json import JSONDecodeError
+from queue import Empty, Full, Queue
+from threading import Event, Thread
 from time import time
 from tqdm import tqdm
 
 import os
 import pandas as pd
+import re
 
-ACCEPTED_TYPES = ('.csv', '.xlsx', '.json', '.txt')
+try:
+    from orjson import loads
+except ImportError:
+    from json import loads
 
-def get_engine(settings):
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+
+try:
+    import pyarrow
+    import pyarrow.csv
+    import pyarrow.feather
+    import pyarrow.ipc
+    import pyarrow.json
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+ACCEPTED_TYPES = ('.csv', '.xlsx', '.json', '.txt', '.parquet', '.feather')
+# Bytes of text pyarrow parses per block
+ARROW_BLOCK_SIZE = 1 << 24
+# Characters of a JSON array read at a time, a record longer than MAX_JSON_RECORD is counted as malformed
+JSON_BLOCK_SIZE = 1 << 20
+MAX_JSON_RECORD = 1 << 26
+JSON_SEPARATORS = re.compile(r'[\s,]*')
+# Strings (closed or running to the end of the buffer), brackets and commas, skipped over to resume after a malformed value
+JSON_TOKENS = re.compile(r'(?P<string>"(?:[^"\\]|\\.)*(?P<close>"|\\?\Z))|[\[\]{},]')
+# Leading rows of a sheet searched for its header
+HEADER_ROWS = 20
+# Formatted chunks a worker process may have waiting per file in parallel directory reads
+FILE_QUEUE_SIZE = 2
+# Queues and stop event of a worker process of readDirectoryParallel, set by initWorker
+worker = {}
+
+def get_engine(settings, **kwargs):
+    # Server-side cursors are enabled per connection by readSQL, other queries keep buffered cursors
     url = get_engine_url(settings['database'], settings['host'], settings['user'], settings['password'])
-    return create_engine(url, echo = False)
+    return create_engine(url, echo = False, **kwargs)
 
 def get_engine_url(dbname, host, user, password, dialect="mysql", driver="pymysql", charset="utf8mb4"):
     return f"{dialect}+{driver}://{user}:{password}@{host}/{dbname}?charset={charset}"
 
-def readJSON(path, encoding):
-    data = []
-    try:
-        with open(path, encoding=encoding) as f:
-            data = json.load(f)
-    # Usually this is a sign of an error in the json file
-    # The behavior below will read all lines until the issue arises
-    except JSONDecodeError:
+def readJSON(path, encoding, chunksize, malformed=None):
+    """DataFrames of 'chunksize' records from a top level JSON array or a JSON lines file, read incrementally.
+    Malformed records are skipped and counted in malformed['records'] instead of ending the file."""
+    malformed = malformed if malformed is not None else {}
+    malformed.setdefault('records', 0)
+    with open(path, encoding=encoding) as f:
+        start = f.read(JSON_BLOCK_SIZE)
+        records = iterArray(f, start, malformed) if start.lstrip().startswith('[') else iterLines(f, start, malformed)
+        while True:
+            batch = list(islice(records, chunksize() if callable(chunksize) else chunksize))
+            if not batch:
+                return
+            yield pd.DataFrame(batch)
+
+def iterLines(f, start, malformed):
+    lines = chain(StringIO(start + f.readline()), f)
+    for line in lines:
+        if not line.strip():
+            continue
         try:
-            for line in open(path, 'r'):
-                data.append(json.loads(line))
-        except JSONDecodeError:
-            print(len(data))
-            pass
-    return [pd.DataFrame(data)]
+            yield loads(line)
+        except ValueError:
+            malformed['records'] += 1
+
+def iterArray(f, buffer, malformed):
+    """Values of a top level array, decoded one at a time with the C scanner of json from a sliding text buffer.
+    After a malformed value the scan resumes after the next comma outside of strings and nested values."""
+    decoder = json.JSONDecoder()
+    pos = buffer.index('[') + 1
+    eof = False
+    while True:
+        pos = JSON_SEPARATORS.match(buffer, pos).end()
+        if pos >= len(buffer):
+            if eof:
+                return
+            buffer, pos = f.read(JSON_BLOCK_SIZE), 0
+            eof = not buffer
+            continue
+        if buffer[pos] == ']':
+            return
+        try:
+            value, end = decoder.raw_decode(buffer, pos)
+            # A number near the end of the buffer may continue in the next block ('12' of '1234', '1' of '1e5')
+            truncated = isinstance(value, (int, float)) and not isinstance(value, bool) and len(buffer) - end < 8
+            error = None
+        except JSONDecodeError as e:
+            truncated = len(buffer) - e.pos < 8 or e.msg.startswith('Unterminated string')
+            error = e.pos
+        if truncated and not eof and len(buffer) - pos < MAX_JSON_RECORD:
+            # Decoded text is dropped, the value is decoded again with the next block appended
+            more = f.read(JSON_BLOCK_SIZE)
+            eof = not more
+            buffer, pos = buffer[pos:] + more, 0
+            continue
+        if error is None:
+            yield value
+            pos = end
+            continue
+        malformed['records'] += 1
+        buffer, pos, eof = skipValue(f, buffer, pos, eof)
+        if pos is None:
+            return
+
+def skipValue(f, buffer, pos, eof):
+    """Position after the comma ending the value at 'pos', None when the array or the file ends first."""
+    depth = 0
+    while True:
+        match = JSON_TOKENS.search(buffer, pos)
+        # Strings may hold brackets and commas, they are only skipped once they are closed
+        if match is None or (match.group('string') is not None and match.group('close') != '"'):
+            if eof:
+                return buffer, None, eof
+            keep = match.start() if match else len(buffer)
+            more = f.read(JSON_BLOCK_SIZE)
+            eof = not more
+            buffer, pos = buffer[keep:] + more, 0
+            continue
+        token = match.group()
+        pos = match.end()
+        if token in '[{':
+            depth += 1
+        elif token in ']}':
+            if depth == 0 and token == ']':
+                return buffer, None, eof
+            depth = max(depth - 1, 0)
+        elif token == ',' and depth == 0:
+            return buffer, pos, eof
+
+def readSQL(sql, settings, chunksize=None, **kwargs):
+    """pd.read_sql in chunks over a connection of its own, held until the generator is exhausted or closed.
+    With 'stream' ON the rows come from a server-side cursor, so memory is bounded by the chunk size."""
+    base = settings['source_engine'].connect()
+    connection = base.execution_options(stream_results=True) if settings.get('stream', False) else base
+    completed = False
+    try:
+        yield from pd.read_sql(sql, con=connection, chunksize=chunksize or settings['chunksize'], **kwargs)
+        completed = True
+    finally:
+        # An abandoned stream still has rows pending on the server, the connection cannot go back to the pool
+        if not completed and settings.get('stream', False):
+            base.invalidate()
+        base.close()
+
+def keysetPredicate(pks, last):
+    """Rows strictly after 'last' in primary key order, expanded as (a > x) OR (a = x AND b > y) so the index is used."""
+    clauses = []
+    for i, pk in enumerate(pks):
+        clauses.append(and_(*[pks[j] == last[j] for j in range(i)], pk > last[i]))
+    return or_(*clauses)
+
+def toPython(value):
+    # Numpy and pandas scalars cannot be bound by the driver
+    if isinstance(value, pd.Timestamp):
+        return value.to_pydatetime()
+    return value.item() if hasattr(value, 'item') else value
+
+def readKeyset(table, engine, chunksize, last=None):
+    """Read a table one 'WHERE pk > :last ORDER BY pk LIMIT :chunksize' page at a time. Only one page is ever held in memory.
+    'chunksize' may be a callable, asked for the size of every page."""
+    pks = list(table.primary_key.columns)
+    # Checkpoints written before typed values were supported hold datetime keys as strings
+    if last is not None:
+        last = [datetime.fromisoformat(v) if isinstance(v, str) and isinstance(pk.type, DateTime) else v for pk, v in zip(pks, last)]
+    while True:
+        size = chunksize() if callable(chunksize) else chunksize
+        query = select(table).order_by(*pks).limit(size)
+        if last is not None:
+            query = query.where(keysetPredicate(pks, last))
+        df = pd.read_sql(query, con=engine)
+        if df.shape[0] == 0:
+            return
+        last = [toPython(df[pk.name].iloc[-1]) for pk in pks]
+        # Dates, datetimes and decimals are tagged by the checkpoint store
+        df.attrs['checkpoint'] = {'last_pk': last}
+        yield df
+        if df.shape[0] < size:
+            return
+
+def filterExisting(df, id_field, existing_ids):
+    # Id indexes answer membership for the whole column at once, plain collections go through pandas
+    existing = existing_ids.isin(df[id_field]) if hasattr(existing_ids, 'isin') else df[id_field].isin(existing_ids)
+    return df[~existing].copy()
+
+def resizedChunks(reader, chunksize):
+    # The reader is asked for the current chunk size before every chunk
+    try:
+        while True:
+            try:
+                yield reader.get_chunk(chunksize())
+            except StopIteration:
+                return
+    finally:
+        # Also when the consumer stops early, the file handle is released
+        reader.close()
+
+def readLines(path, chunksize, encoding):
+    """One value per line, in a column named 0. Numeric files (e.g. tweet ids) are parsed as numbers."""
+    with open(path, encoding=encoding) as f:
+        while True:
+            size = chunksize() if callable(chunksize) else chunksize
+            lines = [line.rstrip('\r\n') for line in islice(f, size)]
+            if not lines:
+                return
+            try:
+                yield pd.DataFrame({0: pd.to_numeric(pd.Series(lines))})
+            except ValueError:
+                yield pd.DataFrame({0: lines})
+
+def readExcel(path, chunksize, sheet=None):
+    """DataFrames of 'chunksize' rows streamed from a sheet (name or position, the first one by default) of an xlsx workbook.
+    A name made of digits that is not a sheet of the workbook is read as a position, as the setting may come from text.
+    The header is the leading row holding only text in the most cells (the first of them on ties), title rows above it
+    are skipped. A row whose only blank cell is the first one counts as full, to_excel leaves the index name blank.
+    Without such a row the first non-empty row is the header.
+    As with read_excel(index_col=0) the first column is the index, cells past the header are 'Unnamed: n' columns
+    and blank rows are kept as missing values, except at the end of the sheet."""
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        if isinstance(sheet, str) and sheet not in workbook.sheetnames and sheet.isdigit():
+            sheet = int(sheet)
+        worksheet = workbook.worksheets[sheet or 0] if sheet is None or isinstance(sheet, int) else workbook[sheet]
+        rows = worksheet.iter_rows(values_only=True)
+        leading = list(islice(rows, HEADER_ROWS))
+        filled = [sum(value is not None for value in row) for row in leading]
+        if not leading or not max(filled):
+            return
+        text = [i for i, row in enumerate(leading) if filled[i] and all(isinstance(value, str) for value in row if value is not None)]
+        full = [filled[i] + (row[0] is None and filled[i] == rowWidth(row) - 1) for i, row in enumerate(leading)]
+        header = max(text, key=lambda i: full[i]) if text else next(i for i in range(len(leading)) if filled[i])
+        names = list(leading[header])
+        width = 0
+        rows = withoutTrailingBlanks(chain(leading[header + 1:], rows))
+        while True:
+            size = chunksize() if callable(chunksize) else chunksize
+            batch = [tuple(row) for row in islice(rows, size)]
+            if not batch:
+                return
+            # Columns grow with the widest row read so far, so later chunks keep the columns of earlier ones
+            width = max([width, rowWidth(names)] + [rowWidth(row) for row in batch])
+            columns = [names[i] if i < len(names) and names[i] is not None else f"Unnamed: {i}" for i in range(width)]
+            df = pd.DataFrame([(row + (None,) * width)[:width] for row in batch], columns=columns)
+            df = df.set_index(columns[0])
+            df.index.name = names[0]
+            yield df
+    finally:
+        workbook.close()
+
+def rowWidth(row):
+    return max((i + 1 for i, value in enumerate(row) if value is not None), default=0)
+
+def withoutTrailingBlanks(rows):
+    # Blank rows are counted until a filled row follows them, formatted sheets may end with many of them
+    blanks = 0
+    for row in rows:
+        if any(value is not None for value in row):
+            yield from repeat((), blanks)
+            blanks = 0
+            yield row
+        else:
+            blanks += 1
 
-def readFile(path, settings, id_field = None, existing_ids = None, json_orientation = 'columns', start_chunk=0):
-    chunksize = settings['chunksize']
+def arrowChunks(batches, chunksize):
+    """pyarrow record batches regrouped into DataFrames of 'chunksize' rows, whatever the batch sizes of the file."""
+    buffered = []
+    rows = 0
+    size = chunksize() if callable(chunksize) else chunksize
+    for batch in batches:
+        buffered.append(batch)
+        rows += batch.num_rows
+        while rows >= size:
+            table = pyarrow.Table.from_batches(buffered)
+            yield table.slice(0, size).to_pandas()
+            rest = table.slice(size)
+            buffered = rest.to_batches()
+            rows = rest.num_rows
+            size = chunksize() if callable(chunksize) else chunksize
+    if rows:
+        yield pyarrow.Table.from_batches(buffered).to_pandas()
+
+def frameChunks(frames, chunksize):
+    """DataFrames regrouped into 'chunksize' rows. Columns typed differently from one frame to the next are unified by pd.concat."""
+    buffered = []
+    rows = 0
+    size = chunksize() if callable(chunksize) else chunksize
+    for df in frames:
+        buffered.append(df)
+        rows += df.shape[0]
+        while rows >= size:
+            df = pd.concat(buffered, ignore_index=True) if len(buffered) > 1 else buffered[0]
+            yield df.iloc[:size].reset_index(drop=True)
+            buffered = [df.iloc[size:]]
+            rows -= size
+            size = chunksize() if callable(chunksize) else chunksize
+    if rows:
+        yield pd.concat(buffered, ignore_index=True)
+
+def readFeather(path, columns=None):
+    """Record batches of a feather file, one at a time from the memory map."""
+    try:
+        reader = pyarrow.ipc.open_file(pyarrow.memory_map(path))
+    # Feather V1 files are not IPC files, they can only be read whole
+    except pyarrow.ArrowInvalid:
+        table = pyarrow.feather.read_table(path, memory_map=True)
+        yield from (table.select([c for c in columns if c in table.column_names]) if columns else table).to_batches()
+        return
+    columns = [c for c in columns if c in reader.schema.names] if columns else None
+    for i in range(reader.num_record_batches):
+        batch = reader.get_batch(i)
+        yield batch.select(columns) if columns else batch
+
+def readJSONBlocks(path, malformed=None):
+    """DataFrames of a JSON lines file parsed block by block, each with the types of its own values.
+    A block pyarrow cannot type (a field holding numbers then text) is parsed line by line like readJSON."""
+    malformed = malformed if malformed is not None else {}
+    malformed.setdefault('records', 0)
+    rest = b''
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(ARROW_BLOCK_SIZE)
+            block = rest + data
+            # A block ends on the last full line, the rest is carried to the next one
+            end = len(block) if not data else block.rfind(b'\n') + 1
+            if end == 0 and data:
+                rest = block
+                continue
+            block, rest = block[:end], block[end:]
+            if block.strip():
+                try:
+                    yield pyarrow.json.read_json(pyarrow.BufferReader(block), read_options=pyarrow.json.ReadOptions(block_size=ARROW_BLOCK_SIZE)).to_pandas()
+                except pyarrow.ArrowInvalid:
+                    yield pd.DataFrame(list(iterLines(StringIO(block.decode('utf-8')), '', malformed)))
+            if not data:
+                return
+
+def readArrow(path, filetype, chunksize, encoding, columns=None, malformed=None):
+    """Memory mapped reads through pyarrow. Text is parsed on several threads, columnar files are read
+    row group by row group (record batch by record batch for feather) and only 'columns' are decoded.
+    Csv columns are read as text, types are left to the handler's CoercionPlan like the other readers' text."""
+    if filetype == '.parquet':
+        parquet = pyarrow.parquet.ParquetFile(path, memory_map=True)
+        columns = [c for c in columns if c in parquet.schema_arrow.names] if columns else None
+        return arrowChunks(parquet.iter_batches(batch_size=chunksize() if callable(chunksize) else chunksize, columns=columns), chunksize)
+    if filetype == '.feather':
+        return arrowChunks(readFeather(path, columns), chunksize)
+    if filetype == '.json':
+        return frameChunks(readJSONBlocks(path, malformed), chunksize)
+    return arrowChunks(readCSVBatches(path, encoding), chunksize)
+
+def readCSVBatches(path, encoding):
+    """Record batches of a csv file, every column read as text. Types inferred from the first block would make
+    a later block with other values fail. Opened on the first batch, so parse errors reach readFile."""
+    with open(path, encoding=encoding, newline='') as f:
+        names = next(csv.reader(f), [])
+    # Same values as read_csv with na_filter=False: empty cells are empty strings
+    yield from pyarrow.csv.open_csv(pyarrow.memory_map(path),
+        read_options=pyarrow.csv.ReadOptions(encoding=encoding, block_size=ARROW_BLOCK_SIZE),
+        convert_options=pyarrow.csv.ConvertOptions(column_types={name.lstrip('\ufeff'): pyarrow.string() for name in names}, strings_can_be_null=False))
+
+def readFile(path, settings, id_field = None, existing_ids = None, json_orientation = 'columns', start_chunk=0, start_row=0, chunksize=None, skipped=None, columns=None):
+    # 'chunksize' may be a callable returning the current size, files then follow it chunk by chunk
+    get_chunksize = chunksize if callable(chunksize) else None
+    chunksize = get_chunksize() if get_chunksize else chunksize or settings['chunksize']
     encoding = settings['encoding'] if 'encoding' in settings else 'UTF-8'
     # print(f"\nReading '{path}' file.")
     # print(f"Chunk size: {chunksize}. Encoding: {encoding}.")
     filetype = splitext(path)[1]
-    if filetype == ACCEPTED_TYPES[0]:
+    malformed = {'records': 0}
+    if filetype in ACCEPTED_TYPES[4:] and pyarrow is None:
+        raise ImportError(f"pyarrow is required to read '{path}'")
+    # Parquet and feather files are always read through pyarrow, csv and json lines files when 'arrow' is ON
+    if filetype in ACCEPTED_TYPES[4:] or (settings.get('arrow', False) and pyarrow and filetype in (ACCEPTED_TYPES[0], ACCEPTED_TYPES[2])):
+        chunks = readArrow(path, filetype, get_chunksize or chunksize, encoding, columns, malformed)
+    elif filetype == ACCEPTED_TYPES[0]:
         chunks = pd.read_csv(path, chunksize=chunksize, na_filter=False, encoding=encoding)
-    if filetype == ACCEPTED_TYPES[1]:
+        chunks = resizedChunks(chunks, get_chunksize) if get_chunksize else chunks
+    elif filetype == ACCEPTED_TYPES[1] and openpyxl:
+        chunks = readExcel(path, get_chunksize or chunksize, settings.get('excel_sheet'))
+    elif filetype == ACCEPTED_TYPES[1]:
         chunks = [pd.read_excel(path, index_col=0)]
-    if filetype == ACCEPTED_TYPES[2]:
-        chunks = pd.read_json(path, chunksize=chunksize, orient=json_orientation, encoding=encoding, lines=True)
-        # Uncomment below for problematic json
-        # chunks = readJSON(path, encoding)
-    if filetype == ACCEPTED_TYPES[3]:
-        chunks = pd.read_csv(path, chunksize=chunksize, sep="\n", header=None)
+    elif filetype == ACCEPTED_TYPES[2]:
+        chunks = readJSON(path, encoding, get_chunksize or chunksize, malformed)
+    elif filetype == ACCEPTED_TYPES[3]:
+        chunks = readLines(path, get_chunksize or chunksize, encoding)
     try:
+        # Rows read so far, checkpoints record it since chunk sizes may differ between runs
+        row = 0
         for i, df in enumerate(chunks):
-            if i >= start_chunk:
-                yield df[~df[id_field].isin(existing_ids)].copy() if id_field else df
+            first_row = row
+            row += df.shape[0]
+            if i < start_chunk or row <= start_row:
+                continue
+            if first_row < start_row:
+                df = df.iloc[start_row - first_row:]
+            df = filterExisting(df, id_field, existing_ids) if id_field else df
+            df.attrs['checkpoint'] = {'file': path, 'row': row}
+            yield df
     # If chunks cannot be read, the file will be logged as skipped
     except ValueError as e:
+        # Rows of the file were already sent, skipping the rest of it would lose them silently
+        if row:
+            print(f"Failed reading {path} after {row} rows: {e}")
+            raise
+        # Worker processes report it instead, the consumer writes the log in file order
+        if skipped is not None:
+            skipped.append(path)
+        else:
+            with open("skippedFiles.txt", "a") as f:
+                f.write(f"Skipped {path}\n")
+    if malformed['records']:
+        print(f"Skipped {malformed['records']} malformed records in {path}.")
         with open("skippedFiles.txt", "a") as f:
-            f.write(f"Skipped {path}\n")
+            f.write(f"Skipped {malformed['records']} malformed records in {path}\n")
     # print(f"Finished processing {path}.")
 
 def getFiles(directory):
     print(f"Opening '{directory}' folder.")
     dir = os.path.join(os.getcwd(), directory)
-    files = [f for f in listdir(dir) if isfile(join(dir, f)) and splitext(join(dir, f))[1] in ACCEPTED_TYPES]
+    # Sorted so that a checkpoint's file position is meaningful across runs
+    files = sorted(f for f in listdir(dir) if isfile(join(dir, f)) and splitext(join(dir, f))[1] in ACCEPTED_TYPES)
+    if pyarrow is None:
+        columnar = [f for f in files if splitext(f)[1] in ACCEPTED_TYPES[4:]]
+        if columnar:
+            print(f"Warning: skipping {len(columnar)} parquet and feather files, pyarrow is not installed.")
+            files = [f for f in files if f not in columnar]
     return files
 
-def readDirectory(directory, settings, id_field = None, existing_ids = None, start_chunk=0):
-    progression = tqdm(getFiles(directory))
+def readDirectory(directory, settings, id_field = None, existing_ids = None, start_chunk=0, position=None, chunksize=None, columns=None):
+    files = getFiles(directory)
+    # Resuming from a checkpoint skips the files that were already processed
+    if position:
+        files = [f for f in files if os.path.join(directory, f) >= position['file']]
+    progression = tqdm(files)
     for file in progression:
         progression.set_description(desc=f"Opening {file}", refresh=True)
         path = os.path.join(directory, file)
-        yield from readFile(path, settings, id_field, existing_ids, start_chunk)
+        start_row = position['row'] if position and path == position['file'] else 0
+        yield from readFile(path, settings, id_field, existing_ids, start_chunk=start_chunk, start_row=start_row, chunksize=chunksize, columns=columns)
+
+def initWorker(queues, stop):
+    # Process queues can only reach a worker when it starts, files then name the queue ('slot') of their chunks
+    for queue in queues:
+        # Chunks left on a queue when the consumer stopped early must not keep the worker from exiting
+        queue.cancel_join_thread()
+    worker['queues'] = queues
+    worker['stop'] = stop
+
+def readFormattedFile(path, settings, plan, start_row=0, columns=None, slot=0):
+    """Worker process side of readDirectoryParallel: every chunk of a file, formatted, put on the queue of 'slot' as soon as it is ready.
+    The file's timings are put last. 'settings' only holds plain values, engines and sessions cannot be sent to another process."""
+    queue, stop = worker['queues'][slot], worker['stop']
+    read = format = 0
+    rows = 0
+    skipped = []
+    chunks = readFile(path, settings, start_row=start_row, skipped=skipped, columns=columns)
+    try:
+        while True:
+            start = time()
+            df = next(chunks, None)
+            read += time() - start
+            if df is None:
+                break
+            start = time()
+            position = df.attrs.get('checkpoint')
+            df = plan.apply(df) if plan is not None else df
+            df.attrs['checkpoint'] = position
+            df.attrs['formatted'] = True
+            format += time() - start
+            rows += df.shape[0]
+            if not putUnlessStopped(queue, df, stop):
+                return
+        putUnlessStopped(queue, {'file': path, 'rows': rows, 'read': read, 'format': format, 'skipped': bool(skipped)}, stop)
+    finally:
+        chunks.close()
+
+def putUnlessStopped(queue, item, stop):
+    # Blocks while the consumer is behind (backpressure) unless it went away
+    while not stop.is_set():
+        try:
+            queue.put(item, timeout=1)
+            return True
+        except Full:
+            pass
+    return False
+
+def processContext():
+    # Forked workers would inherit the parent's memory, threads and open connections
+    return multiprocessing.get_context('forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn')
+
+def readDirectoryParallel(directory, settings, workers, plan=None, id_field = None, existing_ids = None, position=None, chunksize=None, timings=None, columns=None):
+    """readDirectory with files parsed and formatted by 'plan' in a pool of worker processes.
+    Files are yielded in the same order as readDirectory. One file per worker is read at a time, each streams its chunks
+    through the queue of a free slot (FILE_QUEUE_SIZE chunks), so at most 'workers' x FILE_QUEUE_SIZE chunks wait in memory.
+    Per file timings are appended to 'timings'."""
+    files = getFiles(directory)
+    if position:
+        files = [f for f in files if os.path.join(directory, f) >= position['file']]
+    print(f"Reading {len(files)} files with {workers} worker processes.")
+    progression = tqdm(total=len(files))
+    pending = []
+    context = processContext()
+    # Plain process queues, chunks are pickled once into a pipe rather than through a manager process
+    queues = [context.Queue(maxsize=FILE_QUEUE_SIZE) for i in range(workers)]
+    slots = list(range(workers))
+    stop = context.Event()
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=initWorker, initargs=(queues, stop))
+    try:
+        files = iter(files)
+        while True:
+            # Bounded read ahead: a new file is only submitted as a finished one is consumed
+            for file in islice(files, workers - len(pending)):
+                path = os.path.join(directory, file)
+                start_row = position['row'] if position and path == position['file'] else 0
+                size = chunksize() if callable(chunksize) else chunksize or settings['chunksize']
+                worker_settings = {'chunksize': size, 'encoding': settings.get('encoding', 'UTF-8'), 'arrow': settings.get('arrow', False), 'excel_sheet': settings.get('excel_sheet')}
+                slot = slots.pop()
+                pending.append((pool.submit(readFormattedFile, path, worker_settings, plan, start_row, columns, slot), slot))
+            if not pending:
+                return
+            # Files are consumed in submission order, whichever worker finishes first
+            future, slot = pending.pop(0)
+            queue = queues[slot]
+            while True:
+                try:
+                    item = queue.get(timeout=1)
+                except Empty:
+                    # A failed worker never puts its timings, its error is raised here
+                    if future.done():
+                        future.result()
+                    continue
+                if isinstance(item, dict):
+                    stats = item
+                    break
+                yield filterExisting(item, id_field, existing_ids) if id_field else item
+            # The timings were the file's last item, its queue is empty and free for the next file
+            slots.append(slot)
+            if stats['skipped']:
+                with open("skippedFiles.txt", "a") as f:
+                    f.write(f"Skipped {stats['file']}\n")
+            if timings is not None:
+                timings.append(stats)
+            progression.set_description(desc=f"Read {os.path.basename(stats['file'])} in {stats['read'] + stats['format']:.1f}s", refresh=False)
+            progression.update()
+    finally:
+        # Workers blocked on a full queue give up when the consumer stops early, files not started yet are dropped
+        stop.set()
+        pool.shutdown(cancel_futures=True)
+        for queue in queues:
+            queue.close()
+        progression.close()
+
+def prefetch(chunks, depth):
+    """Iterate a chunk generator from a reader thread, keeping at most 'depth' chunks ready ahead of the consumer."""
+    queue = Queue(maxsize=depth)
+    stop = Event()
+    end = object()
+    errors = []
+
+    def put(item):
+        # Blocks while the queue is full (backpressure) unless the consumer went away
+        while not stop.is_set():
+            try:
+                queue.put(item, timeout=1)
+                return True
+            except Full:
+                pass
+        return False
+
+    def reader():
+        try:
+            for chunk in chunks:
+                if not put(chunk):
+                    break
+        except Exception as e:
+            errors.append(e)
+        finally:
+            chunks.close()
+            put(end)
+
+    thread = Thread(target=reader, daemon=True)
+    thread.start()
+    try:
+        while True:
+            chunk = queue.get()
+            if chunk is end:
+                break
+            yield chunk
+        if errors:
+            raise errors[0]
+    finally:
+        stop.set()
+        thread.join()
 
 def timer(func):
     def wrap_func(*args, **kwargs):
@@ -0,0 +1,83 @@
+from collections import defaultdict
+from datetime import datetime
+from threading import Lock
+from time import time
+import json
+import os
+
+# Seconds spent per chunk in each stage of a transfer. With prefetching, reading overlaps the other
+# stages and with partitioned writers 'execute' adds up the writers' seconds, so stages do not add up to the run's time.
+STAGES = ('read', 'format', 'build', 'execute', 'commit')
+# Per chunk counts
+COUNTERS = ('rows', 'retries', 'fallbacks', 'splits', 'failed')
+
+class RunMetrics():
+    """Per-handler, per-chunk stage timings and counters of a run, reported as JSON and as a Prometheus textfile."""
+
+    def __init__(self):
+        self.lock = Lock()
+        self.started = datetime.now()
+        self.chunks = defaultdict(list)
+        # Per file read and format timings of parallel directory reads
+        self.files = defaultdict(list)
+        # Wall-clock start and seconds of each table's transfer
+        self.began = {}
+        self.seconds = defaultdict(float)
+
+    def begin(self, table):
+        with self.lock:
+            self.began[table] = time()
+
+    def finish(self, table):
+        with self.lock:
+            self.seconds[table] += time() - self.began.pop(table)
+
+    def record(self, table, values):
+        with self.lock:
+            self.chunks[table].append({key: values.get(key, 0) for key in COUNTERS + STAGES})
+
+    def summary(self):
+        tables = {}
+        with self.lock:
+            for table, chunks in self.chunks.items():
+                totals = {key: sum(chunk[key] for chunk in chunks) for key in COUNTERS + STAGES}
+                # A table still being transferred counts until now
+                seconds = self.seconds[table] + (time() - self.began[table] if table in self.began else 0)
+                totals['chunks'] = len(chunks)
+                totals['seconds'] = seconds
+                totals['rows_per_second'] = totals['rows'] / seconds if seconds else 0
+                tables[table] = totals
+        return tables
+
+    def writeReport(self, path):
+        report = {
+            'started': self.started.isoformat(),
+            'finished': datetime.now().isoformat(),
+            'tables': self.summary(),
+            'chunks': dict(self.chunks),
+            'files': dict(self.files),
+        }
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=4)
+
+    def writePrometheus(self, path):
+        summary = self.summary()
+        lines = []
+        def metric(name, kind, description, samples):
+            lines.append(f"# HELP datasync_{name} {description}")
+            lines.append(f"# TYPE datasync_{name} {kind}")
+            for labels, value in samples:
+                labels = ",".join(f'{key}="{value}"' for key, value in labels.items())
+                lines.append(f"datasync_{name}{{{labels}}} {value}")
+        metric('rows_total', 'counter', 'Rows read per table.', [({'table': t}, s['rows']) for t, s in summary.items()])
+        metric('chunks_total', 'counter', 'Chunks transferred per table.', [({'table': t}, s['chunks']) for t, s in summary.items()])
+        metric('stage_seconds_total', 'counter', 'Seconds spent per transfer stage.', [({'table': t, 'stage': stage}, s[stage]) for t, s in summary.items() for stage in STAGES])
+        metric('retries_total', 'counter', 'Writes retried after server errors.', [({'table': t}, s['retries']) for t, s in summary.items()])
+        metric('fallbacks_total', 'counter', 'Writes that fell back to updates or row isolation.', [({'table': t}, s['fallbacks']) for t, s in summary.items()])
+        metric('splits_total', 'counter', 'Batch splits made to isolate conflicting rows.', [({'table': t}, s['splits']) for t, s in summary.items()])
+        metric('failed_total', 'counter', 'Writes given up after retries, their rows were pickled.', [({'table': t}, s['failed']) for t, s in summary.items()])
+        metric('rows_per_second', 'gauge', 'Rows per second of wall-clock transfer time.', [({'table': t}, s['rows_per_second']) for t, s in summary.items()])
+        # Written aside and renamed so the textfile collector never reads a partial file
+        with open(f"{path}.tmp", 'w', encoding='utf-8') as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(f"{path}.tmp", path)
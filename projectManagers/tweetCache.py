@@ -0,0 +1,131 @@
+from threading import Lock
+import humanize
+import json
+import os
+import sqlite3
+import time
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# A new segment file is started once the current one reaches this size
+SEGMENT_SIZE = 1 << 30
+# Ids per index lookup, below SQLite's limit of bound parameters
+LOOKUP_SIZE = 500
+# Segment of ids the API did not return in caches written before they had a table of their own
+MISSING = -1
+# Seconds an id the API did not return (deleted, protected or suspended tweets) is not requested again
+MISSING_TTL = 24 * 3600
+
+class TweetCache():
+    """Raw hydrated tweets keyed by id, in compressed JSON lines segments with a SQLite index.
+    Each put writes one compressed frame, a lookup decompresses every frame it needs once.
+    Ids the API did not return are remembered for 'missing_ttl' seconds, a protected account may become public again."""
+
+    def __init__(self, directory, missing_ttl=MISSING_TTL):
+        self.directory = directory
+        self.missing_ttl = missing_ttl
+        os.makedirs(directory, exist_ok=True)
+        # zstandard when installed, zlib otherwise. Each segment keeps the codec it was written with.
+        self.extension = '.zst' if zstandard else '.zz'
+        self.lock = Lock()
+        # Hydration may run in a prefetching reader thread
+        self.index = sqlite3.connect(os.path.join(directory, 'index.db'), check_same_thread=False)
+        self.index.execute("CREATE TABLE IF NOT EXISTS tweets (id TEXT PRIMARY KEY, segment INTEGER, offset INTEGER, length INTEGER, line INTEGER) WITHOUT ROWID")
+        self.index.execute("CREATE TABLE IF NOT EXISTS segments (segment INTEGER PRIMARY KEY, name TEXT)")
+        self.index.execute("CREATE TABLE IF NOT EXISTS missing (id TEXT PRIMARY KEY, checked REAL) WITHOUT ROWID")
+        # Missing ids of older caches were never checked again, they are due now
+        self.index.execute("INSERT OR IGNORE INTO missing SELECT id, 0 FROM tweets WHERE segment = ?", (MISSING,))
+        self.index.execute("DELETE FROM tweets WHERE segment = ?", (MISSING,))
+        self.index.commit()
+        self.segments = dict(self.index.execute("SELECT segment, name FROM segments"))
+        self.segment = max(self.segments, default=None)
+        if self.segment is None or not self.segments[self.segment].endswith(self.extension) or self.size(self.segment) >= SEGMENT_SIZE:
+            self.newSegment()
+        self.hits = 0
+        self.misses = 0
+        self.known_missing = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+    def __del__(self):
+        self.index.close()
+
+    def size(self, segment):
+        path = os.path.join(self.directory, self.segments[segment])
+        return os.path.getsize(path) if os.path.isfile(path) else 0
+
+    def newSegment(self):
+        self.segment = max(self.segments, default=-1) + 1
+        self.segments[self.segment] = f"segment_{self.segment:05d}{self.extension}"
+        self.index.execute("INSERT INTO segments VALUES (?, ?)", (self.segment, self.segments[self.segment]))
+        self.index.commit()
+
+    def get(self, ids):
+        """Cached tweets among 'ids', and the ids that have to be hydrated."""
+        ids = [str(id) for id in ids]
+        rows = []
+        missing = []
+        with self.lock:
+            for i in range(0, len(ids), LOOKUP_SIZE):
+                batch = ids[i:i + LOOKUP_SIZE]
+                placeholders = ','.join('?' * len(batch))
+                rows += self.index.execute(f"SELECT id, segment, offset, length, line FROM tweets WHERE id IN ({placeholders})", batch).fetchall()
+                missing += self.index.execute(f"SELECT id FROM missing WHERE id IN ({placeholders}) AND checked >= ?", batch + [time.time() - self.missing_ttl]).fetchall()
+        frames = {}
+        for id, segment, offset, length, line in rows:
+            frames.setdefault((segment, offset, length), []).append(line)
+        tweets = []
+        for (segment, offset, length), lines in frames.items():
+            frame = self.read(segment, offset, length).split(b"\n")
+            tweets += [json.loads(frame[line]) for line in lines]
+        found = {row[0] for row in rows}
+        known_missing = {row[0] for row in missing} - found
+        missing = [id for id in ids if id not in found and id not in known_missing]
+        self.hits += len(found)
+        self.known_missing += len(known_missing)
+        self.misses += len(missing)
+        return tweets, missing
+
+    def put(self, tweets, requested):
+        """Stores a hydrated batch as one frame. Requested ids that did not come back are recorded as missing,
+        only call it once every lookup of 'requested' was answered."""
+        tweets = list(tweets)
+        data = "\n".join(json.dumps(tweet) for tweet in tweets).encode()
+        frame = zstandard.ZstdCompressor().compress(data) if self.extension == '.zst' else zlib.compress(data)
+        with self.lock:
+            rows = []
+            if tweets:
+                if self.size(self.segment) >= SEGMENT_SIZE:
+                    self.newSegment()
+                with open(os.path.join(self.directory, self.segments[self.segment]), 'ab') as f:
+                    offset = f.tell()
+                    f.write(frame)
+                self.bytes_written += len(frame)
+                # The frame is written before it is indexed, an interruption only leaves unreferenced bytes
+                rows = [(tweet['id_str'], self.segment, offset, len(frame), line) for line, tweet in enumerate(tweets)]
+            returned = {row[0] for row in rows}
+            self.index.executemany("INSERT OR REPLACE INTO tweets VALUES (?, ?, ?, ?, ?)", rows)
+            self.index.executemany("DELETE FROM missing WHERE id = ?", [(id,) for id in returned])
+            now = time.time()
+            self.index.executemany("INSERT OR REPLACE INTO missing VALUES (?, ?)", [(str(id), now) for id in requested if str(id) not in returned])
+            self.index.commit()
+
+    def read(self, segment, offset, length):
+        name = self.segments[segment]
+        with open(os.path.join(self.directory, name), 'rb') as f:
+            f.seek(offset)
+            frame = f.read(length)
+        self.bytes_read += length
+        if name.endswith('.zst'):
+            return zstandard.ZstdDecompressor().decompress(frame)
+        return zlib.decompress(frame)
+
+    def report(self):
+        total = self.hits + self.misses + self.known_missing
+        ratio = self.hits / total if total else 0
+        size = sum(self.size(segment) for segment in self.segments)
+        return f"Tweet cache: {ratio:.1%} hits ({self.hits} of {total} ids), {self.known_missing} known missing, read {humanize.naturalsize(self.bytes_read)}, wrote {humanize.naturalsize(self.bytes_written)}, {humanize.naturalsize(size)} on disk."
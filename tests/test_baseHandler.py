@@ -0,0 +1,87 @@
+import pickle
+
+import pytest
+from sqlalchemy import Column, Integer, String, create_engine
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import Session
+
+from projectManagers.handlers import baseHandler
+from projectManagers.handlers.baseHandler import BaseHandler
+
+Base = declarative_base()
+
+class Item(Base):
+    __tablename__ = 'items'
+    id = Column(Integer, primary_key=True)
+    name = Column(String, nullable=False)
+
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+class ItemsHandler(BaseHandler):
+    __tablename__ = 'items'
+    supports_bulk = True
+
+    def __init__(self, meta):
+        super().__init__(meta)
+        self.Mapper = Item
+
+    def build(self, **kwargs):
+        return Item(**kwargs)
+
+@pytest.fixture
+def session():
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        session.add_all([Item(id=i, name='old') for i in range(0, 10, 2)])
+        session.commit()
+        yield session
+
+def handler(**meta):
+    return ItemsHandler(dict({'commit': True, 'update': True, 'upsert': False}, **meta))
+
+def names(session):
+    return dict(session.query(Item.id, Item.name).order_by(Item.id))
+
+def rows(ids):
+    return [{'id': i, 'name': 'new'} for i in ids]
+
+def test_bulk_mix_of_new_and_existing_rows_is_isolated(session):
+    stats = handler().execute_bulk(session, rows(range(10)))
+    assert names(session) == {i: 'new' for i in range(10)}
+    assert stats['splits'] > 0 and stats['fallbacks'] == 2 and not stats['failed']
+
+def test_orm_mix_of_new_and_existing_rows_is_isolated(session):
+    dicts = rows(range(10))
+    stats = handler().execute(session, [Item(**row) for row in dicts], dicts)
+    assert names(session) == {i: 'new' for i in range(10)}
+    assert stats['splits'] > 0
+
+def test_upsert_writes_new_and_existing_rows_in_one_statement(session):
+    stats = handler(upsert=True).execute_bulk(session, rows(range(10)))
+    assert names(session) == {i: 'new' for i in range(10)}
+    assert stats['fallbacks'] == 0
+
+def test_duplicates_raise_without_update(session):
+    with pytest.raises(IntegrityError):
+        handler(update=False).execute_bulk(session, rows(range(3)))
+
+def test_other_integrity_errors_are_not_treated_as_existing_rows(session):
+    with pytest.raises(IntegrityError):
+        handler().execute_bulk(session, rows(range(1, 4)) + [{'id': 20, 'name': None}])
+    session.rollback()
+    assert names(session) == {i: 'old' for i in range(0, 10, 2)}
+
+def test_rows_are_pickled_after_the_last_retry(session, monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(baseHandler.time, 'sleep', lambda seconds: None)
+    monkeypatch.setattr(baseHandler.tempfile, 'tempdir', str(tmp_path))
+    def fail(*args, **kwargs):
+        raise OperationalError('INSERT', {}, Exception('server has gone away'))
+    monkeypatch.setattr(session, 'execute', fail)
+    stats = handler().execute_bulk(session, rows([1]))
+    assert stats['failed'] == 1 and stats['retries'] == 5
+    dumps = list(tmp_path.glob('*.pkl'))
+    assert len(dumps) == 1 and pickle.loads(dumps[0].read_bytes()) == rows([1])
@@ -0,0 +1,94 @@
+import time
+
+import pandas as pd
+from sqlalchemy import Column, Integer, String, create_engine
+from sqlalchemy.ext.declarative import declarative_base
+
+from projectManagers.baseManager import BaseManager, PartitionedWriter
+from projectManagers.handlers.baseHandler import BaseHandler
+
+Base = declarative_base()
+
+class Item(Base):
+    __tablename__ = 'items'
+    id = Column(Integer, primary_key=True)
+    name = Column(String)
+
+class SlowHandler():
+    supports_bulk = False
+
+    def getTableName(self):
+        return 'items'
+
+    def getCheckpointKey(self):
+        return 'items'
+
+    def getData(self):
+        for i in range(3):
+            time.sleep(0.05)
+            yield pd.DataFrame({'id': range(i * 10, i * 10 + 10)})
+
+    def format_data(self, df):
+        time.sleep(0.1)
+        return df
+
+    def postOperations(self, session):
+        pass
+
+def test_prefetched_reads_are_timed_at_the_source():
+    manager = BaseManager({'target_engine': create_engine('sqlite://'), 'prefetch': 2})
+    manager.write = lambda handler, session, df: {}
+    manager.transfer(SlowHandler())
+    metrics = manager.meta['metrics']
+    # Chunks read while the previous one was formatted are not reported as free
+    assert all(chunk['read'] >= 0.04 for chunk in metrics.chunks['items'])
+    summary = metrics.summary()['items']
+    assert summary['rows'] == 30
+    # Reading overlapped formatting, the run took less than its stages added up
+    assert summary['seconds'] < summary['read'] + summary['format']
+    assert summary['rows_per_second'] == summary['rows'] / summary['seconds']
+
+class ItemsHandler(BaseHandler):
+    __tablename__ = 'items'
+    supports_bulk = True
+
+    def __init__(self, meta, chunks):
+        super().__init__(meta)
+        self.Mapper = Item
+        self.chunks = chunks
+
+    def getData(self):
+        for i, df in enumerate(self.chunks):
+            df.attrs['checkpoint'] = {'chunk': i}
+            yield df
+
+    def format_data(self, df):
+        return df
+
+    def postOperations(self, session):
+        pass
+
+def test_partitioned_writers_checkpoint_whole_chunks(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'target.db'}", connect_args={'check_same_thread': False})
+    Base.metadata.create_all(engine)
+    meta = {'target_engine': engine, 'writers': 3, 'bulk': True, 'commit': True, 'update': True, 'upsert': False}
+    manager = BaseManager(meta)
+    chunks = [pd.DataFrame({'id': range(i * 100, i * 100 + 100), 'name': 'new'}) for i in range(3)]
+    # A checkpoint is only saved once every partition of its chunk is committed
+    committed = []
+    def checkpoint(handler, position):
+        with engine.connect() as connection:
+            committed.append((position['chunk'], connection.exec_driver_sql("SELECT COUNT(*) FROM items").scalar()))
+    manager.checkpoint = checkpoint
+    manager.transfer(ItemsHandler(meta, chunks))
+    assert committed == [(0, 100), (1, 200), (2, 300)]
+    assert [chunk['rows'] for chunk in manager.meta['metrics'].chunks['items']] == [100, 100, 100]
+
+def test_a_key_always_goes_to_the_same_writer():
+    meta = {'target_engine': create_engine('sqlite://')}
+    writer = PartitionedWriter(BaseManager(meta), ItemsHandler(meta, []), 4)
+    df = pd.DataFrame({'id': range(1000), 'name': 'new'})
+    partitions = writer.partition(df)
+    assert set(partitions) == {0, 1, 2, 3}
+    assert (writer.partition(df.iloc[::-1])[::-1] == partitions).all()
+    writer.close()
@@ -0,0 +1,29 @@
+from datetime import date, datetime, time
+from decimal import Decimal
+
+from projectManagers.checkpoints import CheckpointStore
+
+def test_typed_positions_round_trip(tmp_path):
+    path = str(tmp_path / 'checkpoints.jsonl')
+    position = {'last_pk': [datetime(2021, 5, 1, 12, 30), date(2021, 5, 1), time(8, 15), Decimal('1.10'), b'\x00\xff', 'text', 3]}
+    store = CheckpointStore(path)
+    store.save('posts', position)
+    del store
+    assert CheckpointStore(path).get('posts') == position
+
+def test_last_position_wins_and_cleared_keys_are_dropped(tmp_path):
+    path = str(tmp_path / 'checkpoints.jsonl')
+    store = CheckpointStore(path)
+    store.save('a', {'offset': 1})
+    store.save('a', {'offset': 2})
+    store.save('b', {'offset': 1})
+    store.clear('b')
+    del store
+    store = CheckpointStore(path)
+    assert store.get('a') == {'offset': 2}
+    assert store.get('b') is None
+
+def test_partial_last_line_is_ignored(tmp_path):
+    path = tmp_path / 'checkpoints.jsonl'
+    path.write_text('{"key": "a", "position": {"offset": 1}}\n{"key": "a", "posi', encoding='utf-8')
+    assert CheckpointStore(str(path)).get('a') == {'offset': 1}
@@ -0,0 +1,25 @@
+from projectManagers.chunker import AdaptiveChunker, MAX_BYTES, MIN_CHUNK_SIZE, TARGET_SECONDS
+
+def test_size_moves_at_most_by_a_factor_of_two(tmp_path):
+    chunker = AdaptiveChunker(str(tmp_path / 'sizes.json'), 10000)
+    # Far faster than the target latency
+    chunker.record('t', 10000, TARGET_SECONDS / 1000, 10000)
+    assert chunker.size('t') == 20000
+    # Far slower
+    chunker.record('t', 20000, TARGET_SECONDS * 1000, 20000)
+    assert chunker.size('t') == 10000
+
+def test_memory_ceiling_and_bounds(tmp_path):
+    chunker = AdaptiveChunker(str(tmp_path / 'sizes.json'), 10000, in_flight=4)
+    # Rows of 1MB, only MAX_BYTES / 1MB / 4 fit in flight
+    chunker.record('t', 10000, TARGET_SECONDS / 1000, 10000 * 1024 ** 2)
+    assert chunker.size('t') == max(MIN_CHUNK_SIZE, int(MAX_BYTES / 1024 ** 2 / 4))
+    chunker.record('empty', 0, 1, 0)
+    assert chunker.size('empty') == 10000
+
+def test_sizes_are_saved_for_the_next_run(tmp_path):
+    path = str(tmp_path / 'sizes.json')
+    chunker = AdaptiveChunker(path, 10000)
+    chunker.record('t', 10000, TARGET_SECONDS / 1000, 10000)
+    chunker.save()
+    assert AdaptiveChunker(path, 5000).size('t') == 20000
@@ -0,0 +1,38 @@
+from datetime import datetime
+
+import pandas as pd
+from sqlalchemy import Column, DateTime, Integer, JSON, MetaData, Numeric, Table
+
+from projectManagers.coercion import CoercionPlan, parseJSON, toDatetime, toNumber
+
+def test_parse_json_values():
+    series = pd.Series(['{"a": 1}', '[1, 2]', '', None, '"text"'])
+    assert parseJSON(series).tolist() == [{'a': 1}, [1, 2], None, None, 'text']
+
+def test_unparsable_json_is_left_as_is():
+    series = pd.Series(['{"a": 1}', 'not json'])
+    assert parseJSON(series).tolist() == series.tolist()
+
+def test_to_number_keeps_integers_integral():
+    assert toNumber(pd.Series(['1', None, '3']), integer=True).dtype == 'Int64'
+    assert toNumber(pd.Series(['1.5', 'x']), integer=True).tolist()[0] == 1.5
+
+def test_to_datetime_is_naive_utc_to_the_second():
+    values = toDatetime(pd.Series(['2021-05-01T12:30:15.250+02:00', '2021-05-01 08:00:00', None, '']))
+    assert values.tolist() == [datetime(2021, 5, 1, 10, 30, 15), datetime(2021, 5, 1, 8), None, None]
+
+def test_plan_applies_column_types():
+    table = Table('t', MetaData(), Column('id', Integer), Column('score', Numeric), Column('data', JSON), Column('created', DateTime))
+    df = pd.DataFrame({'id': ['1', '2'], 'score': ['1.5', None], 'data': ['{"a": 1}', ''], 'created': ['2021-05-01', None]})
+    df = CoercionPlan(table).apply(df)
+    assert df['id'].tolist() == [1, 2]
+    # MySQL does not accept NaN, missing numbers become 0
+    assert df['score'].tolist() == [1.5, 0]
+    assert df['data'].tolist() == [{'a': 1}, None]
+    assert df['created'].tolist() == [datetime(2021, 5, 1), None]
+
+def test_values_holding_commas_stay_in_their_row():
+    # Joined into one array these would parse as [1, 2, [3, 4]], three values for three rows
+    series = pd.Series(['1,2', '[3', '4]'])
+    assert parseJSON(series).tolist() == series.tolist()
+    assert parseJSON(pd.Series(['[1,2]', '3'])).tolist() == [[1, 2], 3]
@@ -0,0 +1,50 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from benchmarks.hydrator import SyntheticHydrator
+from benchmarks.twitterServer import LookupServer
+from projectManagers.handlers import concurrentHydrator
+from projectManagers.handlers.concurrentHydrator import ConcurrentHydrator
+
+IDS = list(range(10 ** 18, 10 ** 18 + 2000))
+
+@pytest.fixture
+def server():
+    server = LookupServer(tokens=['a', 'b'], limit=1000, error_rate=0.05, gzip_error_rate=0.05).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture(autouse=True)
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(concurrentHydrator.random, 'uniform', lambda low, high: 0.001)
+
+def test_every_returned_tweet_comes_back_once(server):
+    hydrator = ConcurrentHydrator(['a', 'b'], workers=4, url=server.url)
+    tweets = [tweet['id_str'] for tweet in hydrator.hydrate(IDS)]
+    expected = [tweet['id_str'] for tweet in SyntheticHydrator().hydrate(IDS)]
+    assert sorted(tweets) == expected
+    # Server errors and corrupted bodies were retried
+    assert server.stats['errors'] and server.stats['gzip_errors']
+    assert hydrator.scheduler.errors >= server.stats['errors']
+
+def test_rejected_credentials_leave_the_rotation(server):
+    hydrator = ConcurrentHydrator(['revoked', 'a'], workers=2, url=server.url)
+    assert len(list(hydrator.hydrate(IDS[:500]))) == len(list(SyntheticHydrator().hydrate(IDS[:500])))
+    assert server.stats['rejected'] >= 1
+    assert hydrator.scheduler.credentials[0].disabled
+
+def test_quota_without_headers_waits_for_the_default_window(monkeypatch):
+    monkeypatch.setattr(concurrentHydrator, 'DEFAULT_WINDOW', 1)
+    scheduler = concurrentHydrator.TokenScheduler(['a'])
+    credential = scheduler.credentials[0]
+    credential.remaining = 2
+    for i in range(2):
+        scheduler.release(scheduler.acquire(), SimpleNamespace(headers={}, status_code=200))
+    start = time.time()
+    assert scheduler.acquire() is credential
+    # The quota came back after the assumed window instead of never
+    assert 0.9 <= time.time() - start < 5
+    assert credential.remaining == concurrentHydrator.DEFAULT_LIMIT - 1
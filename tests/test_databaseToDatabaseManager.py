@@ -0,0 +1,52 @@
+import threading
+import time
+from types import SimpleNamespace
+
+from projectManagers.baseManager import BaseManager
+from projectManagers.databaseToDatabaseManager import DatabaseToDatabaseManager
+
+def manager(dependencies, workers=3):
+    # Scheduling only needs the handlers and their foreign keys, no engines
+    manager = DatabaseToDatabaseManager.__new__(DatabaseToDatabaseManager)
+    manager.meta = {'workers': workers}
+    manager.TableHandlers = {table: None for table in dependencies}
+    manager.dependencies = dependencies
+    manager.report = lambda: None
+    manager.target_session = SimpleNamespace(close=lambda: None)
+    return manager
+
+def record(manager):
+    events = []
+    lock = threading.Lock()
+    def transferTable(table):
+        with lock:
+            events.append(('start', table))
+        time.sleep(0.05)
+        with lock:
+            events.append(('end', table))
+    manager.transferTable = transferTable
+    return events
+
+def test_parents_finish_before_children_start():
+    dependencies = {'blogsites': set(), 'bloggers': set(), 'blogposts': {'blogsites', 'bloggers'}, 'comments': {'blogposts'}, 'tags': set()}
+    scheduler = manager(dependencies)
+    events = record(scheduler)
+    scheduler.run()
+    assert sorted(table for kind, table in events if kind == 'end') == sorted(dependencies)
+    for table, parents in dependencies.items():
+        for parent in parents:
+            assert events.index(('end', parent)) < events.index(('start', table))
+    # Independent tables run at the same time
+    assert [kind for kind, table in events[:3]] == ['start'] * 3
+
+def test_dependencies_on_tables_not_transferred_are_ignored():
+    scheduler = manager({'blogposts': {'blogsites'}})
+    events = record(scheduler)
+    scheduler.run()
+    assert events == [('start', 'blogposts'), ('end', 'blogposts')]
+
+def test_circular_foreign_keys_fall_back_to_one_table_at_a_time(monkeypatch):
+    calls = []
+    monkeypatch.setattr(BaseManager, 'run', lambda self: calls.append('serial'))
+    manager({'a': {'b'}, 'b': {'a'}}).run()
+    assert calls == ['serial']
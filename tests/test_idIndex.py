@@ -0,0 +1,109 @@
+import numpy as np
+import pytest
+from sqlalchemy import Column, Integer, MetaData, String, Table, create_engine
+from sqlalchemy.orm import Session
+
+from projectManagers.idIndex import BloomIdIndex, IdIndex, StagedIdIndex, toKeys
+from projectManagers.lib import readFile
+
+@pytest.fixture
+def session():
+    engine = create_engine('sqlite://')
+    metadata = MetaData()
+    Table('texts', metadata, Column('id', String, primary_key=True))
+    Table('numbers', metadata, Column('id', Integer, primary_key=True))
+    metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.execute(metadata.tables['texts'].insert(), [{'id': str(i)} for i in range(100)])
+        connection.execute(metadata.tables['numbers'].insert(), [{'id': i} for i in range(100)])
+    session = Session(engine)
+    session.tables = metadata.tables
+    return session
+
+def test_numeric_keys_are_exact():
+    big = 2 ** 62 + 1
+    assert toKeys([big], numeric=True)[0] == toKeys([str(big)], numeric=True)[0] == big
+    assert (toKeys(np.array([1.0, 2.0]), numeric=True) == [1, 2]).all()
+    for values in ([1.5], [np.nan], [float(2 ** 60)], ['']):
+        with pytest.raises(ValueError):
+            toKeys(values, numeric=True)
+
+def test_integer_columns_are_indexed_exactly(session):
+    index = IdIndex().load(session, session.tables['numbers'].c.id)
+    assert index.numeric
+    assert index.isin([5, '6', 500]).tolist() == [True, True, False]
+
+def test_hash_hits_are_confirmed(session):
+    index = IdIndex().load(session, session.tables['texts'].c.id)
+    assert not index.numeric
+    # Stands for a hash collision: the key is indexed but the id is not in the target
+    index.pending = np.union1d(index.pending, toKeys(['collides']))
+    assert index.isin(['5', 'collides']).tolist() == [True, False]
+    index.add(['new'])
+    assert index.isin(['new']).tolist() == [True]
+
+def test_bloom_filter_is_reused_then_rebuilt_when_stale(session, tmp_path, capsys):
+    table = session.tables['texts']
+    path = str(tmp_path / 'texts.bloom')
+    index = BloomIdIndex(path).load(session, table.c.id)
+    assert index.isin(['5', 'absent']).tolist() == [True, False]
+    BloomIdIndex(path).load(session, table.c.id)
+    assert 'Reusing' in capsys.readouterr().out
+    # Another writer inserted rows the filter does not know of
+    session.execute(table.insert(), [{'id': 'other'}])
+    session.commit()
+    index = BloomIdIndex(path).load(session, table.c.id)
+    assert 'Rebuilding' in capsys.readouterr().out
+    assert index.isin(['other']).tolist() == [True]
+
+def test_ids_that_are_not_integers_are_new(session, tmp_path):
+    index = IdIndex().load(session, session.tables['numbers'].c.id)
+    assert index.isin(['', 'abc', 5, 1.5, None]).tolist() == [False, False, True, False, False]
+    index.add(['', 200])
+    assert index.isin([200]).tolist() == [True]
+    path = tmp_path / 'users.csv'
+    path.write_text("id,name\n5,ann\n,bob\nx,cy\n7000,dee\n")
+    chunks = list(readFile(str(path), {'chunksize': 10}, 'id', index))
+    assert [name for df in chunks for name in df['name']] == ['bob', 'cy', 'dee']
+
+def test_added_ids_are_confirmed_by_a_second_hash():
+    index = IdIndex(numeric=False)
+    index.add(['a', 'b'])
+    # Stands for a hash collision with an added id
+    index.pending = np.union1d(index.pending, toKeys(['collides']))
+    assert index.isin(['a', 'collides', 'c']).tolist() == [True, False, False]
+    assert index.checks.dtype == np.uint64
+
+def test_bloom_filter_mixes_integer_ids(session, tmp_path):
+    table = session.tables['numbers']
+    session.execute(table.delete())
+    session.execute(table.insert(), [{'id': i} for i in range(0, 20000, 2)])
+    session.commit()
+    index = BloomIdIndex(str(tmp_path / 'numbers.bloom'), error_rate=0.01).load(session, table.c.id)
+    odd = np.arange(1, 20000, 2)
+    keys = toKeys(odd, numeric=True)
+    maybe = np.ones(len(keys), dtype=bool)
+    for position in index.positions(keys):
+        maybe &= (index.bits[(position >> np.uint64(3)).astype(np.int64)] >> (position & np.uint64(7)).astype(np.uint8)) & np.uint8(1) == 1
+    # Sized for twice the count, the rate stays well under the configured one
+    assert maybe.mean() < 0.02
+    assert not index.isin(odd[:100]).any()
+
+def test_staged_lookups_see_committed_and_sent_ids(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'target.db'}")
+    table = Table('texts', MetaData(), Column('id', String, primary_key=True))
+    table.metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.execute(table.insert(), [{'id': str(i)} for i in range(10)])
+    with Session(engine) as session:
+        index = StagedIdIndex().load(session, table.c.id)
+        assert len(index) == 10
+        assert index.isin(['5', 'new', 5]).tolist() == [True, False, True]
+        index.add(['new', None])
+        assert index.isin(['new', 'other']).tolist() == [True, False]
+        # Rows committed by a writer after the index was loaded
+        with engine.begin() as connection:
+            connection.execute(table.insert(), [{'id': 'other'}])
+        assert index.isin(['other']).tolist() == [True]
+        assert len(index) == 11
+        index.connection.close()
@@ -0,0 +1,189 @@
+import json
+
+import pandas as pd
+import pytest
+from sqlalchemy import Column, DateTime, Integer, MetaData, Table, create_engine
+from sqlalchemy.pool import QueuePool
+
+from projectManagers import lib
+from projectManagers.lib import readJSON
+
+def records(path, chunksize=2):
+    malformed = {}
+    values = [record for df in readJSON(str(path), 'utf-8', chunksize, malformed) for record in df.to_dict(orient='records')]
+    # Fields a record does not have are NaN in its frame
+    return [{key: value for key, value in record.items() if value == value} for record in values], malformed['records']
+
+@pytest.fixture
+def tiny_blocks(monkeypatch):
+    # Every value straddles a block boundary
+    monkeypatch.setattr(lib, 'JSON_BLOCK_SIZE', 4)
+
+def test_compact_array_resumes_after_a_malformed_record(tmp_path, tiny_blocks):
+    path = tmp_path / 'compact.json'
+    path.write_text('[{"id": 1, "text": "a, [b"}, {"id": 2, "text": }, {"id": 3, "list": [1, {"x": ","}]}, {"id": 4}]')
+    assert records(path) == ([{'id': 1, 'text': 'a, [b'}, {'id': 3, 'list': [1, {'x': ','}]}, {'id': 4}], 1)
+
+def test_scalars_straddling_blocks(tmp_path, tiny_blocks):
+    path = tmp_path / 'scalars.json'
+    path.write_text('[{"n": 1234567}, {"n": 89}, {"n": 1e10}, {"n": -0.5}, {"n": true}, {"n": null}]')
+    values, malformed = records(path, chunksize=10)
+    assert [record.get('n') for record in values] == [1234567, 89, 1e10, -0.5, True, None] and malformed == 0
+
+def test_pretty_printed_array(tmp_path, tiny_blocks):
+    path = tmp_path / 'pretty.json'
+    data = [{'id': i, 'tags': ['a', 'b'], 'user': {'name': f"user {i}"}} for i in range(5)]
+    text = json.dumps(data, indent=4).replace('"id": 2', '"id": 2,,')
+    path.write_text(text)
+    values, malformed = records(path)
+    assert [value['id'] for value in values] == [0, 1, 3, 4] and malformed == 1
+
+def test_json_lines(tmp_path):
+    path = tmp_path / 'lines.json'
+    path.write_text('{"id": 1}\n\n{"id": \n{"id": 3}\n')
+    assert records(path) == ([{'id': 1}, {'id': 3}], 1)
+
+@pytest.fixture
+def arrow_blocks(monkeypatch):
+    pytest.importorskip('pyarrow')
+    # A few lines per block, later blocks hold values the first one does not
+    monkeypatch.setattr(lib, 'ARROW_BLOCK_SIZE', 64)
+
+def test_arrow_csv_blocks_do_not_fix_the_types(tmp_path, arrow_blocks):
+    path = tmp_path / 'users.csv'
+    path.write_text("id,score,name\n" + "".join(f"{i},{i},user {i}\n" for i in range(20)) + "20,n/a,late\n21,,\n")
+    chunks = list(lib.readFile(str(path), {'chunksize': 5, 'arrow': True}))
+    df = pd.concat(chunks)
+    assert df.shape[0] == 22 and chunks[-1].attrs['checkpoint']['row'] == 22
+    assert df['score'].tolist()[-3:] == ['19', 'n/a', ''] and df['name'].iloc[-1] == ''
+
+def test_arrow_json_lines_blocks_are_typed_on_their_own(tmp_path, monkeypatch, arrow_blocks):
+    monkeypatch.chdir(tmp_path)
+    path = tmp_path / 'users.json'
+    lines = [{'id': i, 'score': i} for i in range(10)] + [{'id': 10, 'score': 'n/a', 'extra': True}, {'id': 11, 'score': 1.5}]
+    path.write_text("\n".join(json.dumps(line) for line in lines) + '\n{"id": \n')
+    df = pd.concat(lib.readFile(str(path), {'chunksize': 4, 'arrow': True}), ignore_index=True)
+    assert df['id'].tolist() == list(range(12))
+    assert df['score'].tolist()[-3:] == [9, 'n/a', 1.5]
+    assert 'Skipped 1 malformed records' in (tmp_path / 'skippedFiles.txt').read_text()
+
+def test_errors_after_the_first_rows_are_raised(tmp_path, monkeypatch, arrow_blocks):
+    monkeypatch.chdir(tmp_path)
+    path = tmp_path / 'broken.csv'
+    path.write_text("a,b\n" + "".join(f"{i},{i}\n" for i in range(20)) + "5,6,7\n")
+    chunks = lib.readFile(str(path), {'chunksize': 2, 'arrow': True})
+    assert next(chunks)['a'].tolist() == ['0', '1']
+    with pytest.raises(ValueError):
+        list(chunks)
+    # A file that cannot be read at all is still skipped and logged
+    path.write_text("a,b\n1,2,3,4\n")
+    assert list(lib.readFile(str(path), {'chunksize': 2, 'arrow': True})) == []
+    assert 'Skipped' in (tmp_path / 'skippedFiles.txt').read_text()
+
+def workbook(path, rows, title='Sheet'):
+    openpyxl = pytest.importorskip('openpyxl')
+    book = openpyxl.Workbook()
+    book.active.title = title
+    for row in rows:
+        book.active.append(row)
+    book.save(path)
+    return str(path)
+
+def readSheet(path, sheet=None, chunksize=2):
+    return pd.concat(list(lib.readExcel(path, chunksize, sheet)))
+
+def test_excel_header_is_the_fullest_text_row(tmp_path):
+    path = workbook(tmp_path / 'titled.xlsx', [('Report',), (), ('id', 'name'), (1, 'a'), (2, 'b')])
+    df = readSheet(path)
+    assert df.index.name == 'id' and list(df.columns) == ['name']
+    assert df.index.tolist() == [1, 2] and df['name'].tolist() == ['a', 'b']
+
+def test_excel_matches_read_excel(tmp_path):
+    # Cells past the header, blank rows in the data and at the end of the sheet
+    path = workbook(tmp_path / 'ragged.xlsx', [('id', 'name'), (1, 'a'), (None, None), (2, 'b', 5), (3, 'c'), (None, None), (None, None)])
+    df = readSheet(path)
+    expected = pd.read_excel(path, index_col=0)
+    assert list(df.columns) == list(expected.columns) == ['name', 'Unnamed: 2']
+    assert df.shape == expected.shape
+    assert df['name'].isna().tolist() == expected['name'].isna().tolist()
+
+def test_excel_matches_read_excel_on_a_to_excel_export(tmp_path):
+    pytest.importorskip('openpyxl')
+    path = str(tmp_path / 'export.xlsx')
+    pd.DataFrame({'name': ['ann', 'bob', 'cy']}, index=['u1', 'u2', 'u3']).to_excel(path)
+    # The index name cell of the header row is blank, the header is not a data row with more cells
+    pd.testing.assert_frame_equal(readSheet(path), pd.read_excel(path, index_col=0))
+
+def test_excel_sheet_by_name_or_position(tmp_path):
+    path = workbook(tmp_path / 'sheets.xlsx', [('id', 'name'), (1, 'a')], title='data')
+    assert readSheet(path, 'data')['name'].tolist() == ['a']
+    # Settings read from text hold positions as strings
+    assert readSheet(path, '0')['name'].tolist() == ['a']
+
+def test_prefetch_keeps_order_and_closes_the_source():
+    closed = []
+    def chunks():
+        try:
+            yield from range(10)
+        finally:
+            closed.append(True)
+    assert list(lib.prefetch(chunks(), 2)) == list(range(10))
+    reader = lib.prefetch(chunks(), 2)
+    assert next(reader) == 0
+    # The consumer stops early, the reader thread releases the source
+    reader.close()
+    assert closed == [True, True]
+
+def test_prefetch_raises_reader_errors():
+    def chunks():
+        yield 1
+        raise ValueError("broken")
+    reader = lib.prefetch(chunks(), 2)
+    assert next(reader) == 1
+    with pytest.raises(ValueError, match="broken"):
+        next(reader)
+
+@pytest.fixture
+def daily(tmp_path):
+    # Pooled like the MySQL sources, so connections handed back can be counted
+    engine = create_engine(f"sqlite:///{tmp_path / 'source.db'}", poolclass=QueuePool)
+    table = Table('daily', MetaData(), Column('video', Integer, primary_key=True), Column('day', DateTime, primary_key=True), Column('views', Integer))
+    table.metadata.create_all(engine)
+    days = pd.date_range('2021-01-01', periods=5).to_pydatetime()
+    with engine.begin() as connection:
+        connection.execute(table.insert(), [{'video': video, 'day': day, 'views': video} for video in range(20) for day in days])
+    return table, engine
+
+def test_keyset_pages_resume_after_the_last_key(daily):
+    table, engine = daily
+    pages = list(lib.readKeyset(table, engine, lambda: 7))
+    keys = [(video, day) for df in pages for video, day in zip(df['video'], df['day'])]
+    assert len(keys) == 100 and keys == sorted(set(keys))
+    # Resuming from a page's checkpoint reads exactly the pages after it, also from a checkpoint of string datetimes
+    last = pages[5].attrs['checkpoint']['last_pk']
+    for position in (last, [last[0], last[1].isoformat()]):
+        rest = pd.concat(lib.readKeyset(table, engine, 7, last=position))
+        assert rest.shape[0] == 100 - 6 * 7 and rest.iloc[0].tolist()[:2] == list(keys[6 * 7])
+
+def test_read_sql_releases_an_abandoned_stream(daily):
+    table, engine = daily
+    settings = {'source_engine': engine, 'chunksize': 10, 'stream': True}
+    assert sum(df.shape[0] for df in lib.readSQL("SELECT * FROM daily", settings)) == 100
+    chunks = lib.readSQL("SELECT * FROM daily", settings)
+    next(chunks)
+    assert engine.pool.checkedout() == 1
+    chunks.close()
+    assert engine.pool.checkedout() == 0
+
+def test_parallel_directory_reads_keep_file_order(tmp_path):
+    for i in range(5):
+        pd.DataFrame({'id': range(i * 7, i * 7 + 7), 'name': 'x'}).to_csv(tmp_path / f"part_{i}.csv", index=False)
+    settings = {'chunksize': 3}
+    serial = list(lib.readDirectory(str(tmp_path), settings))
+    parallel = list(lib.readDirectoryParallel(str(tmp_path), settings, 2, timings=[]))
+    assert [df['id'].tolist() for df in parallel] == [df['id'].tolist() for df in serial]
+    assert [df.attrs['checkpoint'] for df in parallel] == [df.attrs['checkpoint'] for df in serial]
+    # A consumer that stops early does not wait for the files still queued
+    chunks = lib.readDirectoryParallel(str(tmp_path), settings, 2)
+    next(chunks)
+    chunks.close()
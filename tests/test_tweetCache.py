@@ -0,0 +1,40 @@
+from projectManagers.tweetCache import TweetCache
+
+def tweets(*ids):
+    return [{'id_str': str(id), 'text': f"tweet {id}"} for id in ids]
+
+def test_cached_tweets_are_returned(tmp_path):
+    cache = TweetCache(str(tmp_path))
+    cache.put(tweets(1, 2), [1, 2])
+    cache.put(tweets(3), [3])
+    found, missing = cache.get([1, 3, 4])
+    assert sorted(tweet['id_str'] for tweet in found) == ['1', '3']
+    assert missing == ['4']
+
+def test_index_survives_reopening(tmp_path):
+    cache = TweetCache(str(tmp_path))
+    cache.put(tweets(1), [1])
+    del cache
+    found, missing = TweetCache(str(tmp_path)).get(['1'])
+    assert found == tweets(1) and missing == []
+
+def test_missing_ids_are_reported_apart_and_expire(tmp_path):
+    cache = TweetCache(str(tmp_path))
+    cache.put(tweets(1), [1, 2])
+    found, missing = cache.get([1, 2])
+    assert len(found) == 1 and missing == []
+    assert (cache.hits, cache.known_missing, cache.misses) == (1, 1, 0)
+    assert '1 known missing' in cache.report()
+    expired = TweetCache(str(tmp_path), missing_ttl=-1)
+    assert expired.get([2]) == ([], ['2'])
+    # Returned by a later lookup, the id is no longer missing
+    expired.put(tweets(2), [2])
+    found, missing = cache.get([2])
+    assert found == tweets(2) and cache.known_missing == 1
+
+def test_missing_rows_of_older_caches_are_checked_again(tmp_path):
+    cache = TweetCache(str(tmp_path))
+    cache.index.execute("INSERT INTO tweets VALUES ('3', -1, 0, 0, 0)")
+    cache.index.commit()
+    del cache
+    assert TweetCache(str(tmp_path)).get([3]) == ([], ['3'])
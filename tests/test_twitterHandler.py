@@ -0,0 +1,33 @@
+from collections import deque
+
+import numpy as np
+
+from projectManagers.handlers.twitterHandler import PostsHandler
+from projectManagers.idIndex import IdIndex
+
+def handler(seen=()):
+    # process only needs the id bookkeeping and a hydrator
+    handler = PostsHandler.__new__(PostsHandler)
+    handler.dataset_id = 1
+    handler.seen_ids = IdIndex(numeric=True)
+    handler.seen_ids.add(list(seen))
+    handler.pending_ids = set()
+    handler.users = deque()
+    handler.total_read = handler.total_unique_ids = handler.total_seen = handler.total_fetched = handler.total_duplicates = 0
+    handler.requested = []
+    def hydrate(ids):
+        handler.requested.extend(ids)
+        return []
+    handler.hydrate = hydrate
+    return handler
+
+def test_seeds_that_are_not_ids_are_skipped(capsys):
+    posts = handler(seen=[10 ** 18])
+    posts.process(['id', '1.2e+18', 10 ** 18, str(10 ** 18 + 1), 10 ** 18 + 1, 10 ** 18 + 2, ''])
+    assert sorted(posts.requested) == [10 ** 18 + 1, 10 ** 18 + 2]
+    assert 'Skipped 2 seeds' in capsys.readouterr().out
+    assert posts.total_unique_ids == 3 and posts.total_seen == 1
+    # Ids hydrated but not written yet are not asked for again
+    posts.process([10 ** 18 + 2, 10 ** 18 + 3])
+    assert sorted(posts.requested) == [10 ** 18 + 1, 10 ** 18 + 2, 10 ** 18 + 3]
+    assert all(isinstance(ids, np.ndarray) for users, ids in posts.users)
@@ -0,0 +1,40 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy import create_engine, update
+from sqlalchemy.orm import sessionmaker
+
+from projectManagers.checkpoints import CheckpointStore
+from projectManagers.handlers.youtubeHandler import Base, VideosHandler
+
+Videos = VideosHandler.Videos
+
+@pytest.fixture
+def meta(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'source.db'}")
+    Base.metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.execute(Videos.__table__.insert(), [{'video_id': f"v{i:02d}", 'modified_to_db_time': datetime(2021, 5, 1, 12)} for i in range(10)])
+    return {'source_engine': engine, 'source_session': sessionmaker(bind=engine)(), 'tracker_id': 1, 'last_update': None,
+            'chunksize': 3, 'resume': True, 'checkpoint_store': CheckpointStore(str(tmp_path / 'checkpoints.jsonl'))}
+
+def ids(chunks):
+    return [id for df in chunks for id in df['video_id']]
+
+def test_resume_starts_after_the_last_committed_key(meta):
+    handler = VideosHandler(meta)
+    chunks = handler.getData()
+    first = next(chunks)
+    chunks.close()
+    meta['checkpoint_store'].save(handler.getCheckpointKey(), first.attrs['checkpoint'])
+    assert first.attrs['checkpoint']['last_pk'] == ['v02']
+    # A committed row leaves the day before the restart, an offset would now skip 'v03'
+    with meta['source_engine'].begin() as connection:
+        connection.execute(update(Videos.__table__).where(Videos.video_id == 'v00').values(modified_to_db_time=datetime(2021, 4, 1)))
+    meta['last_update'] = datetime(2021, 5, 1)
+    assert ids(VideosHandler(meta).getData()) == [f"v{i:02d}" for i in range(3, 10)]
+
+def test_checkpoints_holding_a_row_offset_still_resume(meta):
+    handler = VideosHandler(meta)
+    meta['checkpoint_store'].save(handler.getCheckpointKey(), {'day': '2021-05-01T00:00:00', 'row': 6})
+    assert ids(handler.getData()) == ['v06', 'v07', 'v08', 'v09']